@@ -1,4 +1,3 @@
-import asyncio
 import os
 import boto3
 import json
@@ -7,10 +6,9 @@ from urllib.parse import quote_plus
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools.utilities import parameters
 from botocore.config import Config
-from dap.dap_types import Credentials
 from dap.integration.database import DatabaseConnection
-from dap.api import DAPClient
-from dap.replicator.sql import SQLReplicator
+
+from table_common import bootstrap, table_init
 
 region = os.environ.get('AWS_REGION')
 
@@ -29,52 +27,37 @@ param_path = f'/{env}/{ssm_parameter_name}'
 
 api_base_url = os.environ.get('API_BASE_URL', 'https://api-gateway.instructure.com')
 
-def start(event):
-    params = ssm_provider.get_multiple(param_path, max_age=600, decrypt=True)
-    dap_client_id = params['dap_client_id']
-    dap_client_secret = params['dap_client_secret']
+# Set by the state machine when a table is initialized by several tasks in
+# parallel (see table_common/sharded_init.py); unset for a regular single-task init.
+init_phase = os.environ.get('INIT_PHASE')
 
-    db_user_secret = parameters.get_secret(db_user_secret_name, transform="json")
+def get_db_connection(db_user_secret):
     db_user = db_user_secret['username']
     db_password = quote_plus(db_user_secret['password'])
     db_name = db_user_secret['dbname']
     db_host = db_user_secret['host']
     db_port = db_user_secret['port']
-    namespace = os.environ.get('CD2_NAMESPACE', 'canvas')
 
     conn_str = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}?sslmode=verify-ca&sslrootcert=rds-combined-ca-bundle.pem"
-    db_connection = DatabaseConnection(connection_string=conn_str)
-
-    credentials = Credentials.create(client_id=dap_client_id, client_secret=dap_client_secret)
-
-    table_name = event['table_name']
-    logger.info(f"initting table: {table_name}")
-
-    os.chdir("/tmp/")
+    return DatabaseConnection(connection_string=conn_str)
 
-    try:
-        asyncio.get_event_loop().run_until_complete(
-            init_table(credentials, api_base_url, db_connection, namespace, table_name)
-        )
-
-        event['state'] = 'complete'
-
-        # Remove the error message from the sync_table job because it is not necessary after the successful table initialization.
-        if "error_message" in event and "sync_table - needs_init" in event["error_message"]:
-            del event["error_message"]
-
-    except Exception as e:
-        logger.exception(e)
-        event['state'] = 'failed'
-        return event
+def start(event):
+    namespace = os.environ.get('CD2_NAMESPACE', 'canvas')
 
-    logger.info(f"event: {event}")
+    startup = bootstrap.start(namespace, api_base_url, param_path, db_user_secret_name, ssm_provider=ssm_provider)
+    event['startup'] = startup.summary
 
-    return event
+    db_connection = get_db_connection(startup.db_user_secret)
+    credentials = startup.credentials
 
-async def init_table(credentials, api_base_url, db_connection, namespace, table_name):
-    async with DAPClient(api_base_url, credentials) as session:
-        await SQLReplicator(session, db_connection).initialize(namespace, table_name)
+    shard = os.environ.get('INIT_SHARD')
+    shard_results = os.environ.get('INIT_SHARD_RESULTS')
+    return table_init.init(
+        event, credentials, db_connection, namespace, api_base_url,
+        phase=init_phase,
+        shard=int(shard) if shard is not None else None,
+        shard_results=json.loads(shard_results) if shard_results else None,
+    )
 
 if __name__ == "__main__":
     event = json.loads(os.environ.get('TABLE_EVENT'))
@@ -9,6 +9,8 @@ from dap.api import DAPClient
 from dap.dap_types import Credentials
 from shared.utils import publish_alert, get_full_environment_name
 
+import sizing
+
 region = os.environ.get('AWS_REGION')
 
 config = Config(region_name=region)
@@ -50,6 +52,21 @@ def lambda_handler(event, context: LambdaContext):
 
         tmap = list(map(lambda t: {'table_name': t, "state": "needs_sync", "namespace": namespace}, [t for t in tables if t not in skip_tables]))
 
+        # Giant tables can be initialized by several tasks in parallel; the
+        # state machine takes the sharded init path when init_shard_count is set.
+        init_shards = get_init_shards()
+        for t in tmap:
+            if t['table_name'] in init_shards:
+                t['init_shard_count'] = init_shards[t['table_name']]
+
+        # Fargate size per operation, from each table's measured resource usage;
+        # the state machine passes these as RunTask overrides.
+        sizes = sizing.get_task_sizes(
+            namespace, {t['table_name']: sizing.get_operations('init_shard_count' in t) for t in tmap}
+        )
+        for t in tmap:
+            t['task_sizes'] = sizes[t['table_name']]
+
         return {'tables': tmap}
     except Exception as e:
         logger.exception(e)
@@ -67,6 +84,24 @@ def lambda_handler(event, context: LambdaContext):
             raise
 
 
+def get_init_shards():
+    # INIT_SHARD_TABLES is a comma-separated list of table:shards pairs, e.g. "submissions:8,quiz_submissions:4"
+    init_shards = {}
+    for entry in os.environ.get('INIT_SHARD_TABLES', '').split(','):
+        if not entry.strip():
+            continue
+        # A typo here must not stop every table from syncing
+        try:
+            table_name, shards = entry.split(':')
+            shards = int(shards)
+        except ValueError:
+            logger.warning(f"ignoring malformed INIT_SHARD_TABLES entry: {entry!r}")
+            continue
+        if shards > 1:
+            init_shards[table_name.strip()] = shards
+    return init_shards
+
+
 async def async_get_tables(api_base_url: str, credentials: Credentials, namespace: str):
     async with DAPClient(
         base_url=api_base_url,
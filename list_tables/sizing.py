@@ -0,0 +1,188 @@
+import datetime
+import json
+import os
+
+import boto3
+from aws_lambda_powertools import Logger
+
+# Picks a Fargate size class for each table operation from the resource usage
+# the sync/init tasks publish (see table_common/resource_usage.py). The state
+# machine applies the chosen size as RunTask cpu/memory/storage overrides.
+
+logger = Logger()
+
+cloudwatch = boto3.client("cloudwatch")
+
+METRICS_NAMESPACE = os.environ.get("POWERTOOLS_METRICS_NAMESPACE", "canvas-data-2")
+
+TASK_CPU = int(os.environ.get("TASK_CPU", "1024"))
+TASK_MEMORY = int(os.environ.get("TASK_MEMORY", "8192"))
+TASK_STORAGE = int(os.environ.get("TASK_STORAGE", "80"))
+
+SIZING_LOOKBACK_DAYS = int(os.environ.get("SIZING_LOOKBACK_DAYS", "14"))
+# Only move a table below the default size once it has this many runs on record;
+# moving up is allowed on any evidence.
+SIZING_MIN_SAMPLES = int(os.environ.get("SIZING_MIN_SAMPLES", "3"))
+MEMORY_HEADROOM = float(os.environ.get("SIZING_MEMORY_HEADROOM", "1.5"))
+STORAGE_HEADROOM = float(os.environ.get("SIZING_STORAGE_HEADROOM", "1.5"))
+# PeakTmpGB is the used space of the whole ephemeral volume, container image
+# included, so only a little is added on top of the headroom
+STORAGE_RESERVE_GB = float(os.environ.get("SIZING_STORAGE_RESERVE_GB", "1"))
+CPU_TARGET_UTILIZATION = float(os.environ.get("SIZING_CPU_TARGET_UTILIZATION", "0.8"))
+
+OPERATIONS = ["sync", "init", "init_prepare", "init_load", "init_commit"]
+# The operations a table can run: sharded-init tables never run a plain init.
+# Only these get a size, since the sizes travel with the table through every
+# state of the run.
+TABLE_OPERATIONS = ["sync", "init"]
+SHARDED_TABLE_OPERATIONS = ["sync", "init_prepare", "init_load", "init_commit"]
+
+# Powertools adds a "service" dimension (POWERTOOLS_SERVICE_NAME) to everything
+# resource_usage publishes. Only the per-table tasks are read back: a
+# table_worker runs at the worker pool's fixed size, and its process outlives
+# any one table, so its figures say little about what a task for that table needs.
+SERVICES = {
+    "sync": "sync_table",
+    "init": "init_table",
+    "init_prepare": "init_table",
+    "init_load": "init_table",
+    "init_commit": "init_table",
+}
+
+DEFAULT_CLASS = "default"
+
+# Valid Fargate cpu/memory combinations; "default" is the size the stack's
+# TaskCpu/TaskMemory/TaskStorage parameters give the task definitions.
+SIZE_CLASSES = json.loads(os.environ.get("SIZE_CLASSES", "null")) or [
+    {"name": "small", "cpu": 512, "memory": 2048, "storage": 21},
+    {"name": "medium", "cpu": 1024, "memory": 4096, "storage": 40},
+    {"name": DEFAULT_CLASS, "cpu": TASK_CPU, "memory": TASK_MEMORY, "storage": TASK_STORAGE},
+    {"name": "xlarge", "cpu": 2048, "memory": 16384, "storage": 200},
+]
+SIZE_CLASSES.sort(key=lambda c: (c["memory"], c["cpu"], c["storage"]))
+
+# GetMetricData accepts at most 500 queries per call
+MAX_QUERIES = 500
+
+
+def get_class(name):
+    return next(c for c in SIZE_CLASSES if c["name"] == name)
+
+
+def get_metric_dimensions(namespace, table_name, operation):
+    return [
+        {"Name": "cd2_namespace", "Value": namespace},
+        {"Name": "table", "Value": table_name},
+        {"Name": "operation", "Value": operation},
+        {"Name": "service", "Value": SERVICES[operation]},
+    ]
+
+
+def get_operations(sharded):
+    return SHARDED_TABLE_OPERATIONS if sharded else TABLE_OPERATIONS
+
+
+def get_usage(namespace, table_operations):
+    """Returns {(table, operation): usage} for every table operation with history."""
+    queries = []
+    keys = {}
+    for table_name, operations in table_operations.items():
+        for operation in operations:
+            for key, metric, stat in (
+                ("PeakMemoryMB", "PeakMemoryMB", "Maximum"),
+                ("PeakTmpGB", "PeakTmpGB", "Maximum"),
+                ("CpuSeconds", "CpuSeconds", "Sum"),
+                ("WallSeconds", "WallSeconds", "Sum"),
+                # WallSeconds is published once per run that got to the end
+                ("Runs", "WallSeconds", "SampleCount"),
+                ("RunsStarted", "RunsStarted", "Sum"),
+            ):
+                query_id = f"m{len(queries)}"
+                keys[query_id] = (table_name, operation, key)
+                queries.append({
+                    "Id": query_id,
+                    "MetricStat": {
+                        "Metric": {
+                            "Namespace": METRICS_NAMESPACE,
+                            "MetricName": metric,
+                            "Dimensions": get_metric_dimensions(namespace, table_name, operation),
+                        },
+                        "Period": SIZING_LOOKBACK_DAYS * 86400,
+                        "Stat": stat,
+                    },
+                })
+
+    end = datetime.datetime.now(datetime.timezone.utc)
+    start = end - datetime.timedelta(days=SIZING_LOOKBACK_DAYS)
+
+    usage = {}
+    for i in range(0, len(queries), MAX_QUERIES):
+        paginator = cloudwatch.get_paginator("get_metric_data")
+        for page in paginator.paginate(
+            MetricDataQueries=queries[i:i + MAX_QUERIES], StartTime=start, EndTime=end
+        ):
+            for result in page["MetricDataResults"]:
+                if not result["Values"]:
+                    continue
+                table_name, operation, metric = keys[result["Id"]]
+                values = result["Values"]
+                value = max(values) if metric.startswith("Peak") else sum(values)
+                usage.setdefault((table_name, operation), {})[metric] = value
+    return usage
+
+
+def recommend(usage):
+    default = get_class(DEFAULT_CLASS)
+    if not usage:
+        return default
+
+    size_class = get_fitting_class(usage) if "PeakMemoryMB" in usage else default
+    if size_class["memory"] < default["memory"] and usage.get("Runs", 0) < SIZING_MIN_SAMPLES:
+        size_class = default
+
+    # A run that started but never got to publish its final figures was
+    # killed, most likely for running out of memory or disk: go one size up.
+    if usage.get("RunsStarted", 0) > usage.get("Runs", 0):
+        size_class = SIZE_CLASSES[min(SIZE_CLASSES.index(size_class) + 1, len(SIZE_CLASSES) - 1)]
+    return size_class
+
+
+def get_fitting_class(usage):
+    need_memory = usage["PeakMemoryMB"] * MEMORY_HEADROOM
+    need_storage = usage.get("PeakTmpGB", 0) * STORAGE_HEADROOM + STORAGE_RESERVE_GB
+    need_cpu = 0
+    if usage.get("WallSeconds"):
+        cores = usage.get("CpuSeconds", 0) / usage["WallSeconds"]
+        need_cpu = cores * 1024 / CPU_TARGET_UTILIZATION
+
+    for c in SIZE_CLASSES:
+        if c["memory"] >= need_memory and c["storage"] >= need_storage and c["cpu"] >= need_cpu:
+            return c
+    return SIZE_CLASSES[-1]
+
+
+def get_task_sizes(namespace, table_operations):
+    """Returns {table: {operation: {"cpu", "memory", "storage"}}} for {table: [operation]}.
+
+    Every table gets an entry: if the usage history can't be read, all
+    operations fall back to the default size.
+    """
+    try:
+        usage = get_usage(namespace, table_operations)
+    except Exception as e:
+        logger.exception(f"failed to read resource usage history, using default task size: {e}")
+        usage = {}
+
+    sizes = {}
+    size_classes = {}
+    for table_name, operations in table_operations.items():
+        task_sizes = {}
+        for operation in operations:
+            c = recommend(usage.get((table_name, operation)))
+            task_sizes[operation] = {"cpu": c["cpu"], "memory": c["memory"], "storage": c["storage"]}
+            if c["name"] != DEFAULT_CLASS:
+                size_classes[f"{table_name}.{operation}"] = c["name"]
+        sizes[table_name] = task_sizes
+    # The class names are only logged, not added to the table events
+    logger.info(f"non-default task sizes for {namespace}: {json.dumps(size_classes)}")
+    return sizes
@@ -7,15 +7,15 @@ from urllib.parse import quote_plus
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools.utilities import parameters
 from botocore.config import Config
-from dap.api import DAPClient
 from dap.dap_error import ProcessingError
-from dap.dap_types import Credentials
 from dap.integration.database import DatabaseConnection
 from dap.integration.database_errors import NonExistingTableError
 from dap.replicator.sql import SQLReplicator
 from pysqlsync.base import QueryException
 import requests
 
+from table_common import bootstrap, profiling, resource_usage, session_tuning
+
 region = os.environ.get("AWS_REGION")
 
 stepfunctions = boto3.client('stepfunctions')
@@ -90,29 +90,40 @@ def generate_error_string(function_name, table_name, state, exception, cloudwatc
 
     return f"{table_name} - {function_name} - {state}, Error: {message} (<{cloudwatch_log_url}|CloudWatch Log>)"
 
-def start(event):
-    params = ssm_provider.get_multiple(param_path, max_age=600, decrypt=True)
-
-    dap_client_id = params["dap_client_id"]
-    dap_client_secret = params["dap_client_secret"]
-
-    db_user_secret = parameters.get_secret(db_user_secret_name, transform="json")
+def get_db_connection(db_user_secret):
     db_user = db_user_secret["username"]
     db_password = quote_plus(db_user_secret["password"])
     db_name = db_user_secret["dbname"]
     db_host = db_user_secret["host"]
     db_port = db_user_secret["port"]
-    namespace = os.environ.get('CD2_NAMESPACE', 'canvas')
 
     conn_str = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}?sslmode=verify-ca&sslrootcert=rds-combined-ca-bundle.pem"
     db_connection = DatabaseConnection(connection_string=conn_str)
 
-    credentials = Credentials.create(
-        client_id=dap_client_id, client_secret=dap_client_secret
+    return db_connection, db_name
+
+def bootstrap_task(namespace):
+    return bootstrap.start(
+        namespace,
+        api_base_url,
+        param_path,
+        db_user_secret_name,
+        ssm_provider=ssm_provider,
+        get_log_url=get_ecs_log_url,
     )
 
-    cloudwatch_log_url = get_ecs_log_url()
+def start(event):
+    namespace = os.environ.get('CD2_NAMESPACE', 'canvas')
+
+    startup = bootstrap_task(namespace)
+    event["startup"] = startup.summary
+    db_connection, db_name = get_db_connection(startup.db_user_secret)
 
+    return sync(event, startup.credentials, db_connection, db_name, namespace, startup.cloudwatch_log_url)
+
+def sync(event, credentials, db_connection, db_name, namespace, cloudwatch_log_url):
+    # Split out of start() so a long-lived worker (see worker.py) can reuse the
+    # credentials and database connection across many tables.
     table_name = event["table_name"]
 
     logger.info(f"syncing table: {table_name}")
@@ -120,9 +131,12 @@ def start(event):
     os.chdir("/tmp/")
 
     try:
-        asyncio.get_event_loop().run_until_complete(
-            sync_table_with_retry(credentials, api_base_url, db_connection, namespace, table_name)
-        )
+        with resource_usage.measured(event, namespace, table_name, "sync"), \
+                profiling.profiled(event, namespace, table_name), \
+                session_tuning.tuned(event, db_connection, namespace, table_name):
+            asyncio.get_event_loop().run_until_complete(
+                sync_table_with_retry(credentials, api_base_url, db_connection, namespace, table_name)
+            )
 
         event["state"] = STATE_COMPLETE
     except QueryException as e:
@@ -170,13 +184,13 @@ def start(event):
 
 
 async def sync_table(credentials, api_base_url, db_connection, namespace, table_name):
-    async with DAPClient(api_base_url, credentials) as session:
+    async with bootstrap.SharedTokenDAPClient(api_base_url, credentials) as session:
         await SQLReplicator(session, db_connection).synchronize(namespace, table_name)
 
 
 async def sync_table_with_retry(credentials, api_base_url, db_connection, namespace, table_name):
-    # Re-open a fresh DAPClient session on each attempt (new auth + connection)
-    # rather than reusing a session that just hit a server-side job failure.
+    # Re-open a fresh DAPClient session on each attempt (new connection) rather
+    # than reusing a session that just hit a server-side job failure.
     for attempt in range(1, SYNC_MAX_ATTEMPTS + 1):
         try:
             await sync_table(credentials, api_base_url, db_connection, namespace, table_name)
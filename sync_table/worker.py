@@ -0,0 +1,326 @@
+import glob
+import json
+import os
+import queue
+import signal
+import threading
+import time
+import uuid
+
+import boto3
+
+import app
+from table_common import table_init
+
+# Long-lived alternative to launching one Fargate task per table. The state
+# machine drops table jobs on an SQS queue (sqs:sendMessage.waitForTaskToken)
+# and a small pool of these workers pulls them off, runs sync or init with
+# credentials and a database connection set up once at startup, and reports
+# the result back through the task token.
+#
+# A job message looks like:
+#   {"action": "sync" | "init", "task_token": "...", "event": {...table event...}}
+# and an init job may also carry the sharded init phase arguments
+# (init_phase, init_shard, init_shard_results; see table_common/table_init.py).
+
+logger = app.logger
+
+WORKER_QUEUE_URL = os.environ.get("WORKER_QUEUE_URL")
+WORKER_QUEUE_DIR = os.environ.get("WORKER_QUEUE_DIR")
+WORKER_WAIT_SECONDS = int(os.environ.get("WORKER_WAIT_SECONDS", "20"))
+
+# Jobs can run for hours, longer than we want a message to stay invisible if
+# the worker dies. Keep the visibility timeout short and extend it while the
+# job is running; a killed worker's job reappears on the queue within
+# WORKER_VISIBILITY_TIMEOUT_SECONDS and is picked up by another worker.
+WORKER_VISIBILITY_TIMEOUT_SECONDS = int(os.environ.get("WORKER_VISIBILITY_TIMEOUT_SECONDS", "900"))
+WORKER_HEARTBEAT_SECONDS = int(os.environ.get("WORKER_HEARTBEAT_SECONDS", "300"))
+
+# A job whose worker was killed (stopped, OOM) comes back on the queue. Once
+# it has been received more than this many times it is failed back to the
+# state machine instead of run again; left to the queue's redrive policy it
+# would land on the dead-letter queue with the state machine still waiting
+# for its task token. Keep this below the queue's maxReceiveCount.
+WORKER_MAX_RECEIVE_COUNT = int(os.environ.get("WORKER_MAX_RECEIVE_COUNT", "2"))
+
+# A failed receive (throttling, a dropped long poll) is retried after a
+# backoff that doubles up to WORKER_MAX_BACKOFF_SECONDS, rather than letting
+# ECS restart the worker.
+WORKER_MIN_BACKOFF_SECONDS = float(os.environ.get("WORKER_MIN_BACKOFF_SECONDS", "1"))
+WORKER_MAX_BACKOFF_SECONDS = float(os.environ.get("WORKER_MAX_BACKOFF_SECONDS", "60"))
+
+# The credentials and connection string are refreshed periodically so a
+# rotated DB password or DAP secret is picked up without restarting workers.
+WORKER_REFRESH_SECONDS = int(os.environ.get("WORKER_REFRESH_SECONDS", "3600"))
+
+ACTION_SYNC = "sync"
+ACTION_INIT = "init"
+
+
+def parse_job(body):
+    """Decode a job message body, or return None if it isn't a job."""
+    try:
+        job = json.loads(body)
+    except ValueError as e:
+        logger.error(f"job message is not valid JSON ({e}): {body[:1000]!r}")
+        return None
+    if not isinstance(job, dict):
+        logger.error(f"job message is not a JSON object: {body[:1000]!r}")
+        return None
+    return job
+
+
+class SqsJobQueue:
+    def __init__(self, queue_url, sqs_client=None):
+        self.queue_url = queue_url
+        self.sqs = sqs_client or boto3.client("sqs")
+
+    def receive(self, wait_seconds):
+        response = self.sqs.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=1,
+            WaitTimeSeconds=wait_seconds,
+            VisibilityTimeout=WORKER_VISIBILITY_TIMEOUT_SECONDS,
+            AttributeNames=["ApproximateReceiveCount"],
+        )
+        return [
+            (m["ReceiptHandle"], parse_job(m["Body"]), int(m["Attributes"]["ApproximateReceiveCount"]))
+            for m in response.get("Messages", [])
+        ]
+
+    def extend(self, handle):
+        self.sqs.change_message_visibility(
+            QueueUrl=self.queue_url,
+            ReceiptHandle=handle,
+            VisibilityTimeout=WORKER_VISIBILITY_TIMEOUT_SECONDS,
+        )
+
+    def release(self, handle):
+        self.sqs.change_message_visibility(
+            QueueUrl=self.queue_url, ReceiptHandle=handle, VisibilityTimeout=0
+        )
+
+    def delete(self, handle):
+        self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=handle)
+
+
+class LocalJobQueue:
+    """In-process stand-in for SqsJobQueue, for tests and local runs."""
+
+    def __init__(self, jobs=()):
+        self.jobs = queue.Queue()
+        self.in_flight = {}
+        for job in jobs:
+            self.put(job)
+
+    def put(self, job, receive_count=0):
+        self.jobs.put((job, receive_count))
+
+    def receive(self, wait_seconds):
+        try:
+            job, receive_count = self.jobs.get(timeout=wait_seconds)
+        except queue.Empty:
+            return []
+        handle = str(uuid.uuid4())
+        self.in_flight[handle] = (job, receive_count + 1)
+        return [(handle, job, receive_count + 1)]
+
+    def extend(self, handle):
+        pass
+
+    def release(self, handle):
+        self.put(*self.in_flight.pop(handle))
+
+    def delete(self, handle):
+        self.in_flight.pop(handle, None)
+
+
+class FileJobQueue:
+    """File-backed stand-in for SqsJobQueue: one JSON job per file in a directory.
+
+    A received job is renamed to *.inflight so concurrent workers on the same
+    directory don't pick it up twice. Receive counts aren't tracked: every
+    receive counts as the first.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def receive(self, wait_seconds):
+        for file_name in sorted(glob.glob(os.path.join(self.path, "*.json"))):
+            handle = f"{file_name}.inflight"
+            try:
+                os.rename(file_name, handle)
+            except FileNotFoundError:
+                continue
+            with open(handle) as f:
+                return [(handle, parse_job(f.read()), 1)]
+        if wait_seconds:
+            threading.Event().wait(min(wait_seconds, 1))
+        return []
+
+    def extend(self, handle):
+        pass
+
+    def release(self, handle):
+        os.rename(handle, handle[: -len(".inflight")])
+
+    def delete(self, handle):
+        os.remove(handle)
+
+
+def get_job_queue():
+    if WORKER_QUEUE_URL:
+        return SqsJobQueue(WORKER_QUEUE_URL)
+    if WORKER_QUEUE_DIR:
+        return FileJobQueue(WORKER_QUEUE_DIR)
+    raise Exception("Neither WORKER_QUEUE_URL nor WORKER_QUEUE_DIR is set")
+
+
+class Worker:
+    def __init__(self, job_queue, stepfunctions_client=None):
+        self.job_queue = job_queue
+        self.stepfunctions = stepfunctions_client or app.stepfunctions
+        self.draining = threading.Event()
+        self.credentials = None
+        self.db_connection = None
+        self.db_name = None
+        self.cloudwatch_log_url = None
+        self.startup = None
+        self.refreshed_at = None
+
+    def drain(self, signum=None, frame=None):
+        # ECS sends SIGTERM on scale-in/deploy. Stop taking new jobs; the
+        # current one gets the container's StopTimeout to finish, after which
+        # the worker is SIGKILLed and the job's message becomes visible again
+        # once the visibility timeout lapses, to be run by another worker.
+        logger.info("worker draining: no new jobs will be taken")
+        self.draining.set()
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.refreshed_at is not None and now - self.refreshed_at < WORKER_REFRESH_SECONDS:
+            return
+        startup = app.bootstrap_task(os.environ.get('CD2_NAMESPACE', 'canvas'))
+        self.credentials = startup.credentials
+        self.db_connection, self.db_name = app.get_db_connection(startup.db_user_secret)
+        self.cloudwatch_log_url = startup.cloudwatch_log_url
+        self.startup = startup.summary
+        self.refreshed_at = now
+
+    def run(self):
+        logger.info("worker started")
+        backoff = WORKER_MIN_BACKOFF_SECONDS
+        while not self.draining.is_set():
+            try:
+                messages = self.job_queue.receive(WORKER_WAIT_SECONDS)
+            except Exception as e:
+                logger.exception(f"failed to receive jobs, retrying in {backoff:g} s: {e}")
+                self.draining.wait(backoff)
+                backoff = min(backoff * 2, WORKER_MAX_BACKOFF_SECONDS)
+                continue
+            backoff = WORKER_MIN_BACKOFF_SECONDS
+
+            for handle, job, receive_count in messages:
+                try:
+                    self.dispatch(handle, job, receive_count)
+                except Exception as e:
+                    # Releasing or deleting the message failed; it comes
+                    # back once its visibility timeout lapses.
+                    logger.exception(f"failed to handle job message: {e}")
+        logger.info("worker stopped")
+
+    def dispatch(self, handle, job, receive_count):
+        if job is None:
+            # Nothing to run and no task token to report to (see parse_job)
+            self.job_queue.delete(handle)
+        elif self.draining.is_set():
+            self.job_queue.release(handle)
+        elif receive_count > WORKER_MAX_RECEIVE_COUNT:
+            self.abandon(handle, job, receive_count)
+        else:
+            self.process(handle, job)
+
+    def process(self, handle, job):
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(
+            target=self.heartbeat, args=(handle, stop_heartbeat), daemon=True
+        )
+        heartbeat.start()
+        try:
+            self.run_job(job)
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+            # The job has run (and reported, or tried to): running it again
+            # on redelivery would only repeat the same work.
+            self.job_queue.delete(handle)
+
+    def abandon(self, handle, job, receive_count):
+        logger.error(f"giving up on job received {receive_count} times: {json.dumps(job.get('event'))}")
+        self.callback(
+            job.get("task_token"),
+            self.stepfunctions.send_task_failure,
+            error=f"job was received {receive_count} times without finishing; its workers were stopped or killed",
+        )
+        self.job_queue.delete(handle)
+
+    def heartbeat(self, handle, stop):
+        while not stop.wait(WORKER_HEARTBEAT_SECONDS):
+            try:
+                self.job_queue.extend(handle)
+            except Exception as e:
+                logger.exception(f"failed to extend job visibility: {e}")
+
+    def run_job(self, job):
+        token = job.get("task_token")
+        try:
+            self.refresh()
+            result = self.handle(job)
+        except Exception as err:
+            logger.exception(err)
+            self.callback(token, self.stepfunctions.send_task_failure, error=f'{err}')
+            return
+
+        payload = {
+            "Payload": result
+        }
+        self.callback(token, self.stepfunctions.send_task_success, output=json.dumps(payload))
+
+    def callback(self, token, send, **kwargs):
+        # A failed callback (expired token, throttling, output too large) must
+        # not take the worker down or turn a finished job into a failure.
+        if not token:
+            return
+        try:
+            send(taskToken=token, **kwargs)
+        except Exception as e:
+            logger.exception(f"failed to report job result to the state machine: {e}")
+
+    def handle(self, job):
+        action = job["action"]
+        event = job["event"]
+        namespace = event.get("namespace", os.environ.get('CD2_NAMESPACE', 'canvas'))
+        # The worker's own (last) startup, in place of a per-task one
+        event["startup"] = self.startup
+
+        if action == ACTION_SYNC:
+            return app.sync(
+                event, self.credentials, self.db_connection, self.db_name, namespace, self.cloudwatch_log_url
+            )
+        if action == ACTION_INIT:
+            return table_init.init(
+                event, self.credentials, self.db_connection, namespace, app.api_base_url,
+                phase=job.get("init_phase"),
+                shard=job.get("init_shard"),
+                shard_results=job.get("init_shard_results"),
+            )
+        raise ValueError(f"unknown worker action: {action}")
+
+
+if __name__ == "__main__":
+    worker = Worker(get_job_queue())
+    signal.signal(signal.SIGTERM, worker.drain)
+    signal.signal(signal.SIGINT, worker.drain)
+    worker.run()
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+import boto3
+import jwt
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+from aws_lambda_powertools.utilities import parameters
+from dap.api import AccessToken, DAPClient
+from dap.dap_types import Credentials
+
+# Task startup: fetches the DAP client credentials (SSM), the database secret
+# (Secrets Manager) and the ECS log URL concurrently, then exchanges the
+# credentials for a DAP access token.
+#
+# Every table task of a state machine run needs the same values, so they are
+# shared through a short-lived cache:
+#
+# RUN_ID                  cache scope, set to the execution name by the state
+#                         machine; caching is off when unset
+# BOOTSTRAP_CACHE_TABLE   DynamoDB table holding the cached values
+# BOOTSTRAP_CACHE_KEY_ID  KMS key the values are encrypted with before caching
+# BOOTSTRAP_CACHE_DIR     local alternative to the table (plain JSON files, for
+#                         running outside AWS)
+# BOOTSTRAP_CACHE_TTL_SECONDS  lifetime of cached values (default 900); an
+#                         access token is never cached past its own expiry
+#
+# Startup time is published as the StartupSeconds metric.
+
+logger = Logger()
+metrics = Metrics()
+
+RUN_ID = os.environ.get("RUN_ID")
+BOOTSTRAP_CACHE_TABLE = os.environ.get("BOOTSTRAP_CACHE_TABLE")
+BOOTSTRAP_CACHE_KEY_ID = os.environ.get("BOOTSTRAP_CACHE_KEY_ID")
+BOOTSTRAP_CACHE_DIR = os.environ.get("BOOTSTRAP_CACHE_DIR")
+BOOTSTRAP_CACHE_TTL_SECONDS = int(os.environ.get("BOOTSTRAP_CACHE_TTL_SECONDS", "900"))
+
+# Same margin DAP's AccessToken.is_expiring() uses, so a cached token is
+# dropped before a session would log in again anyway.
+TOKEN_EXPIRY_MARGIN_SECONDS = 300
+
+# DAP access tokens by client ID, used by SharedTokenDAPClient
+access_tokens = {}
+
+
+class DynamoDbCache:
+    """Cache items in DynamoDB, encrypted client-side with KMS.
+
+    The cache key is bound to the ciphertext as encryption context, so an item
+    can't be copied under another key. Expired items are ignored on read;
+    DynamoDB's TTL only removes them eventually.
+    """
+
+    def __init__(self, table_name, key_id, dynamodb=None, kms=None):
+        self.table_name = table_name
+        self.key_id = key_id
+        self.dynamodb = dynamodb or boto3.client("dynamodb")
+        self.kms = kms or boto3.client("kms")
+
+    def get(self, key):
+        item = self.dynamodb.get_item(
+            TableName=self.table_name, Key={"cache_key": {"S": key}}, ConsistentRead=True
+        ).get("Item")
+        if not item or int(item["expires_at"]["N"]) <= time.time():
+            return None
+        plaintext = self.kms.decrypt(
+            CiphertextBlob=item["value"]["B"], EncryptionContext={"cache_key": key}
+        )["Plaintext"]
+        return json.loads(plaintext)
+
+    def put(self, key, value, expires_at):
+        ciphertext = self.kms.encrypt(
+            KeyId=self.key_id, Plaintext=json.dumps(value).encode("utf-8"), EncryptionContext={"cache_key": key}
+        )["CiphertextBlob"]
+        self.dynamodb.put_item(
+            TableName=self.table_name,
+            Item={
+                "cache_key": {"S": key},
+                "value": {"B": ciphertext},
+                "expires_at": {"N": str(int(expires_at))},
+            },
+        )
+
+
+class FileCache:
+    """Cache items as JSON files in a local directory, for running outside AWS."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, key.replace("/", "_") + ".json")
+
+    def get(self, key):
+        try:
+            with open(self._file(key)) as f:
+                item = json.load(f)
+        except FileNotFoundError:
+            return None
+        if item["expires_at"] <= time.time():
+            return None
+        return item["value"]
+
+    def put(self, key, value, expires_at):
+        path = self._file(key)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"value": value, "expires_at": int(expires_at)}, f)
+        os.replace(f"{path}.tmp", path)
+
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def put(self, key, value, expires_at):
+        pass
+
+
+def get_cache():
+    if not RUN_ID:
+        return NullCache()
+    if BOOTSTRAP_CACHE_TABLE and BOOTSTRAP_CACHE_KEY_ID:
+        return DynamoDbCache(BOOTSTRAP_CACHE_TABLE, BOOTSTRAP_CACHE_KEY_ID)
+    if BOOTSTRAP_CACHE_DIR:
+        return FileCache(BOOTSTRAP_CACHE_DIR)
+    return NullCache()
+
+
+class SharedTokenDAPClient(DAPClient):
+    """DAPClient whose sessions start with the access token from bootstrap.
+
+    DAPSession.authenticate() skips the login while its token is fresh and
+    logs in again with the credentials once it is about to expire, so a
+    seeded session behaves like one that has already authenticated.
+    """
+
+    async def __aenter__(self):
+        session = await super().__aenter__()
+        token = access_tokens.get(self._credentials.client_id)
+        if token is not None:
+            access_token = AccessToken(token)
+            if not access_token.is_expiring():
+                session._access_token = access_token
+                session._session.headers.update({"Authorization": "Bearer " + token})
+        return session
+
+
+async def get_access_token(api_base_url, credentials):
+    async with DAPClient(api_base_url, credentials) as session:
+        await session.authenticate()
+        return str(session._access_token)
+
+
+def get_token_expiry(token):
+    return int(jwt.decode(token, options={"verify_signature": False})["exp"])
+
+
+@dataclass
+class Bootstrap:
+    credentials: Credentials
+    db_user_secret: dict
+    cloudwatch_log_url: Optional[str] = None
+    summary: dict = field(default_factory=dict)
+
+
+class Loader:
+    """Fetches values through the cache, recording where each one came from."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.sources = {}
+        self.seconds = {}
+
+    def load(self, name, key, fetch, ttl=None):
+        started = time.perf_counter()
+        try:
+            value = self._cached(name, key, fetch, ttl)
+        finally:
+            self.seconds[name] = round(time.perf_counter() - started, 3)
+        return value
+
+    def _cached(self, name, key, fetch, ttl):
+        cache_key = f"{RUN_ID}/{key}"
+        try:
+            value = self.cache.get(cache_key)
+        except Exception as e:
+            logger.warning(f"bootstrap cache read failed for {name}: {e}")
+            value = None
+        if value is not None:
+            self.sources[name] = "cache"
+            return value
+
+        value = fetch()
+        self.sources[name] = "fetched"
+
+        now = time.time()
+        expires_at = now + BOOTSTRAP_CACHE_TTL_SECONDS
+        if ttl is not None:
+            expires_at = min(expires_at, ttl(value))
+        if expires_at > now:
+            try:
+                self.cache.put(cache_key, value, expires_at)
+            except Exception as e:
+                logger.warning(f"bootstrap cache write failed for {name}: {e}")
+        return value
+
+
+def start(
+    namespace,
+    api_base_url,
+    param_path,
+    db_user_secret_name,
+    ssm_provider=None,
+    get_secret=None,
+    get_log_url=None,
+    authenticate=None,
+    cache=None,
+):
+    """Load everything a table task needs before it can start work.
+
+    The SSM, Secrets Manager and DAP lookups default to the real services and
+    can be swapped for stand-ins, as can the cache. The DAP access token is
+    made available to SharedTokenDAPClient.
+    """
+    ssm_provider = ssm_provider or parameters.SSMProvider()
+    get_secret = get_secret or (lambda name: parameters.get_secret(name, transform="json"))
+    authenticate = authenticate or (lambda url, credentials: asyncio.run(get_access_token(url, credentials)))
+    loader = Loader(cache or get_cache())
+
+    def load_credentials():
+        params = loader.load(
+            "parameters",
+            f"parameters:{param_path}",
+            lambda: dict(ssm_provider.get_multiple(param_path, max_age=600, decrypt=True)),
+        )
+        credentials = Credentials.create(
+            client_id=params["dap_client_id"], client_secret=params["dap_client_secret"]
+        )
+        # The token exchange needs the credentials, so it runs after them but
+        # alongside the other lookups.
+        access_tokens[credentials.client_id] = loader.load(
+            "access_token",
+            f"access_token:{credentials.client_id}",
+            lambda: authenticate(api_base_url, credentials),
+            ttl=lambda token: get_token_expiry(token) - TOKEN_EXPIRY_MARGIN_SECONDS,
+        )
+        return credentials
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        credentials = executor.submit(load_credentials)
+        db_user_secret = executor.submit(
+            loader.load, "db_user_secret", f"secret:{db_user_secret_name}", lambda: get_secret(db_user_secret_name)
+        )
+        cloudwatch_log_url = executor.submit(get_log_url) if get_log_url else None
+
+        result = Bootstrap(
+            credentials=credentials.result(),
+            db_user_secret=db_user_secret.result(),
+            cloudwatch_log_url=cloudwatch_log_url.result() if cloudwatch_log_url else None,
+        )
+    elapsed = time.perf_counter() - started
+
+    result.summary = {
+        "seconds": round(elapsed, 3),
+        "sources": loader.sources,
+        "lookup_seconds": loader.seconds,
+    }
+    logger.info(f"bootstrap for {namespace}: {json.dumps(result.summary)}")
+
+    try:
+        metrics.add_dimension(name="cd2_namespace", value=namespace)
+        metrics.add_metric(name="StartupSeconds", unit=MetricUnit.Seconds, value=result.summary["seconds"])
+        hits = sum(1 for source in loader.sources.values() if source == "cache")
+        metrics.add_metric(name="BootstrapCacheHits", unit=MetricUnit.Count, value=hits)
+        metrics.add_metric(name="BootstrapCacheMisses", unit=MetricUnit.Count, value=len(loader.sources) - hits)
+        metrics.flush_metrics()
+    except Exception as e:
+        metrics.clear_metrics()
+        logger.exception(f"failed to publish startup metrics for {namespace}: {e}")
+
+    return result
@@ -0,0 +1,206 @@
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+import boto3
+from aws_lambda_powertools import Logger
+
+# On-demand profiling of a single table's SQLReplicator call.
+#
+# PROFILE_TABLES      comma-separated table names to profile, or "*" for all
+# PROFILE_S3_BUCKET   optional bucket to copy the profile to
+# PROFILE_S3_PREFIX   key prefix in that bucket (default "profiles/")
+# PROFILE_INTERVAL_SECONDS  sampling interval (default 0.01)
+# PROFILE_TOP_N       number of hot functions/tasks in the summary (default 20)
+
+logger = Logger()
+
+PROFILE_TABLES = [t.strip() for t in os.environ.get("PROFILE_TABLES", "").split(",") if t.strip()]
+PROFILE_S3_BUCKET = os.environ.get("PROFILE_S3_BUCKET")
+PROFILE_S3_PREFIX = os.environ.get("PROFILE_S3_PREFIX", "profiles/")
+PROFILE_INTERVAL_SECONDS = float(os.environ.get("PROFILE_INTERVAL_SECONDS", "0.01"))
+PROFILE_TOP_N = int(os.environ.get("PROFILE_TOP_N", "20"))
+PROFILE_DIR = "/tmp"
+
+# The table event is carried through the state machine and passed to later
+# tasks as a container override (8 KB limit), and all tables' events end up in
+# one notification (256 KB), so it only gets a short summary; the full one is
+# logged and written to the profile file.
+PROFILE_EVENT_TOP_N = 5
+
+
+def is_enabled(table_name):
+    return "*" in PROFILE_TABLES or table_name in PROFILE_TABLES
+
+
+def frame_key(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+class Sampler:
+    """Samples one thread's stack from a background thread.
+
+    Sampling rather than tracing keeps the overhead flat regardless of how
+    many calls the replicator makes, so it is safe to leave on in production.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.stacks = Counter()
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_key(frame))
+                frame = frame.f_back
+            self.samples += 1
+            self.self_counts[stack[0]] += 1
+            for key in set(stack):
+                self.total_counts[key] += 1
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def top(self, n):
+        if not self.samples:
+            return []
+        return [
+            {
+                "function": key,
+                "self_pct": round(100 * count / self.samples, 1),
+                "total_pct": round(100 * self.total_counts[key] / self.samples, 1),
+            }
+            for key, count in self.self_counts.most_common(n)
+        ]
+
+
+class TaskTimer:
+    """Records wall time of every asyncio task created on a loop, by coroutine name."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.timings = defaultdict(lambda: {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        self._previous_factory = None
+
+    def start(self):
+        self._previous_factory = self.loop.get_task_factory()
+        self.loop.set_task_factory(self._factory)
+
+    def stop(self):
+        self.loop.set_task_factory(self._previous_factory)
+
+    def _factory(self, loop, coro, **kwargs):
+        if self._previous_factory is not None:
+            task = self._previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        name = getattr(coro, "__qualname__", type(coro).__name__)
+        started = time.perf_counter()
+        task.add_done_callback(lambda _: self._record(name, time.perf_counter() - started))
+        return task
+
+    def _record(self, name, elapsed):
+        timing = self.timings[name]
+        timing["count"] += 1
+        timing["total_seconds"] += elapsed
+        timing["max_seconds"] = max(timing["max_seconds"], elapsed)
+
+    def top(self, n):
+        ranked = sorted(self.timings.items(), key=lambda item: item[1]["total_seconds"], reverse=True)
+        return [
+            {
+                "task": name,
+                "count": timing["count"],
+                "total_seconds": round(timing["total_seconds"], 3),
+                "max_seconds": round(timing["max_seconds"], 3),
+            }
+            for name, timing in ranked[:n]
+        ]
+
+
+@contextlib.contextmanager
+def profiled(event, namespace, table_name):
+    """Profile the enclosed replicator call if PROFILE_TABLES selects this table.
+
+    A short summary is added to event["profile"] even when the call raises,
+    since a failing table is often the one worth looking at.
+    """
+    if not is_enabled(table_name):
+        yield
+        return
+
+    sampler = Sampler(threading.get_ident(), PROFILE_INTERVAL_SECONDS)
+    task_timer = TaskTimer(asyncio.get_event_loop())
+    started = time.perf_counter()
+    task_timer.start()
+    sampler.start()
+    try:
+        yield
+    finally:
+        sampler.stop()
+        task_timer.stop()
+        elapsed = time.perf_counter() - started
+        try:
+            summary = write_profile(namespace, table_name, elapsed, sampler, task_timer)
+            logger.info(f"profile for {namespace}.{table_name}: {json.dumps(summary)}")
+            event["profile"] = get_event_summary(summary)
+        except Exception as e:
+            logger.exception(f"failed to write profile for {namespace}.{table_name}: {e}")
+
+
+def write_profile(namespace, table_name, elapsed, sampler, task_timer):
+    summary = {
+        "elapsed_seconds": round(elapsed, 3),
+        "samples": sampler.samples,
+        "interval_seconds": PROFILE_INTERVAL_SECONDS,
+        "top_functions": sampler.top(PROFILE_TOP_N),
+        "top_tasks": task_timer.top(PROFILE_TOP_N),
+    }
+
+    file_name = f"profile-{namespace}.{table_name}-{int(time.time())}.json"
+    path = os.path.join(PROFILE_DIR, file_name)
+    with open(path, "w") as f:
+        # "stacks" is in collapsed format (frame;frame;frame -> count), which
+        # flamegraph.pl and speedscope read directly.
+        json.dump({**summary, "stacks": dict(sampler.stacks)}, f)
+    summary["path"] = path
+
+    if PROFILE_S3_BUCKET:
+        key = f"{PROFILE_S3_PREFIX}{file_name}"
+        boto3.client("s3").upload_file(path, PROFILE_S3_BUCKET, key)
+        summary["s3_uri"] = f"s3://{PROFILE_S3_BUCKET}/{key}"
+
+    return summary
+
+
+def get_event_summary(summary):
+    event_summary = {
+        "elapsed_seconds": summary["elapsed_seconds"],
+        "samples": summary["samples"],
+        "top_functions": summary["top_functions"][:PROFILE_EVENT_TOP_N],
+        "path": summary["path"],
+    }
+    if "s3_uri" in summary:
+        event_summary["s3_uri"] = summary["s3_uri"]
+    return event_summary
@@ -0,0 +1,149 @@
+import contextlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from aws_lambda_powertools import Logger
+from aws_lambda_powertools.metrics import EphemeralMetrics, MetricUnit
+
+# Per-table resource usage, published as CloudWatch metrics (embedded metric
+# format on stdout, picked up from the task's log stream) so list_tables can
+# size each table's task from its history.
+#
+# Metrics (namespace POWERTOOLS_METRICS_NAMESPACE), dimensioned by
+# cd2_namespace, table, operation and service (added by powertools from
+# POWERTOOLS_SERVICE_NAME; list_tables/sizing.py queries the same set):
+#   RunsStarted                  when the operation starts
+#   PeakMemoryMB, PeakTmpGB      every RESOURCE_PUBLISH_SECONDS and at the end
+#                                (PeakTmpGB: used space of the volume holding /tmp)
+#   CpuSeconds, WallSeconds      at the end
+#
+# A task that is OOM-killed or stopped never gets to the end, so the peaks
+# are also published while it runs, and sizing counts runs that started but
+# never finished.
+
+logger = Logger()
+
+RESOURCE_SAMPLE_SECONDS = float(os.environ.get("RESOURCE_SAMPLE_SECONDS", "5"))
+RESOURCE_PUBLISH_SECONDS = float(os.environ.get("RESOURCE_PUBLISH_SECONDS", "60"))
+TMP_DIR = "/tmp"
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def get_rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def get_used_bytes(path):
+    # Used space of the filesystem holding path: on Fargate /tmp is on the
+    # task's ephemeral volume, so this is the figure that runs out (container
+    # image included). One statvfs call, unlike walking the tree, which would
+    # also descend into other mounts such as /tmp/CrowdStrike and add its CPU
+    # time to CpuSeconds.
+    return shutil.disk_usage(path).used
+
+
+def publish(namespace, table_name, operation, values):
+    """Publish {metric name: (unit, value)} for one table operation.
+
+    Each call gets its own EphemeralMetrics, since this runs on the monitor
+    thread as well and must not pick up (or flush) anyone else's metrics.
+    """
+    try:
+        metrics = EphemeralMetrics()
+        metrics.add_dimension(name="cd2_namespace", value=namespace)
+        metrics.add_dimension(name="table", value=table_name)
+        metrics.add_dimension(name="operation", value=operation)
+        for name, (unit, value) in values.items():
+            metrics.add_metric(name=name, unit=unit, value=value)
+        metrics.flush_metrics()
+    except Exception as e:
+        logger.exception(f"failed to publish resource usage for {namespace}.{table_name}: {e}")
+
+
+class ResourceMonitor:
+    """Tracks peak RSS and ephemeral storage usage from a background thread.
+
+    ru_maxrss is a lifetime peak, which is wrong once a worker has run more
+    than one table, so RSS is sampled instead. on_publish, if given, is
+    called with the monitor every publish_interval seconds.
+    """
+
+    def __init__(self, interval, publish_interval=None, on_publish=None):
+        self.interval = interval
+        self.publish_interval = publish_interval
+        self.on_publish = on_publish
+        self.peak_rss = 0
+        self.peak_tmp = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.sample()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+    def _run(self):
+        last_published = time.monotonic()
+        while not self._stop.wait(self.interval):
+            self.sample()
+            if self.on_publish and time.monotonic() - last_published >= self.publish_interval:
+                last_published = time.monotonic()
+                self.on_publish(self)
+
+    def sample(self):
+        try:
+            self.peak_rss = max(self.peak_rss, get_rss_bytes())
+            self.peak_tmp = max(self.peak_tmp, get_used_bytes(TMP_DIR))
+        except Exception as e:
+            logger.warning(f"resource sample failed: {e}")
+
+
+@contextlib.contextmanager
+def measured(event, namespace, table_name, operation):
+    """Record peak memory, CPU time and ephemeral storage usage of the enclosed table operation.
+
+    The figures are added to event["resource_usage"] and published as
+    metrics even when the operation raises; the peaks so far are also
+    published periodically in case the task is killed.
+    """
+
+    def publish_peaks(monitor):
+        publish(namespace, table_name, operation, {
+            "PeakMemoryMB": (MetricUnit.Megabytes, round(monitor.peak_rss / 2**20, 1)),
+            "PeakTmpGB": (MetricUnit.Gigabytes, round(monitor.peak_tmp / 2**30, 3)),
+        })
+
+    publish(namespace, table_name, operation, {"RunsStarted": (MetricUnit.Count, 1)})
+    monitor = ResourceMonitor(RESOURCE_SAMPLE_SECONDS, RESOURCE_PUBLISH_SECONDS, publish_peaks)
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    monitor.start()
+    try:
+        yield
+    finally:
+        monitor.stop()
+        usage = {
+            "operation": operation,
+            "peak_memory_mb": round(monitor.peak_rss / 2**20, 1),
+            "cpu_seconds": round(time.process_time() - cpu_started, 1),
+            "wall_seconds": round(time.perf_counter() - wall_started, 1),
+            "peak_tmp_gb": round(monitor.peak_tmp / 2**30, 3),
+        }
+        event["resource_usage"] = usage
+        logger.info(f"resource usage for {namespace}.{table_name}: {json.dumps(usage)}")
+
+        publish(namespace, table_name, operation, {
+            "PeakMemoryMB": (MetricUnit.Megabytes, usage["peak_memory_mb"]),
+            "CpuSeconds": (MetricUnit.Seconds, usage["cpu_seconds"]),
+            "WallSeconds": (MetricUnit.Seconds, usage["wall_seconds"]),
+            "PeakTmpGB": (MetricUnit.Gigabytes, usage["peak_tmp_gb"]),
+        })
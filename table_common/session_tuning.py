@@ -0,0 +1,207 @@
+import asyncio
+import contextlib
+import datetime
+import json
+import os
+import time
+
+from aws_lambda_powertools import Logger
+from aws_lambda_powertools.metrics import EphemeralMetrics, MetricUnit
+from pysqlsync.model.data_types import quote
+
+# Bulk-load session settings for inits and large incremental syncs.
+#
+# SESSION_TUNING   off (default) | init | auto | always
+#                  init: tune inits only; auto: inits and incrementals whose
+#                  watermark is at least SESSION_TUNING_MIN_LAG_HOURS old
+# SESSION_TUNING_MIN_LAG_HOURS   (default 24)
+# SESSION_TUNING_SETTINGS        JSON object overriding/adding settings to BULK_SETTINGS
+# SESSION_TUNING_REPLICATION_ROLE  "true" to also set session_replication_role=replica
+#                  during inits (requires rds_superuser)
+#
+# pysqlsync opens its asyncpg connections without server_settings, so the
+# settings are applied with SET on every connection the replicator opens and
+# RESET before it is closed.
+#
+# Every run, tuned or not, publishes its row throughput as the RowsPerSecond
+# metric (namespace POWERTOOLS_METRICS_NAMESPACE), dimensioned by
+# cd2_namespace, table and profile, so untuned runs serve as the baseline.
+
+logger = Logger()
+
+SESSION_TUNING = os.environ.get("SESSION_TUNING", "off")
+SESSION_TUNING_MIN_LAG_HOURS = float(os.environ.get("SESSION_TUNING_MIN_LAG_HOURS", "24"))
+SESSION_TUNING_REPLICATION_ROLE = os.environ.get("SESSION_TUNING_REPLICATION_ROLE", "false").lower() == "true"
+
+MODE_OFF = "off"
+MODE_INIT = "init"
+MODE_AUTO = "auto"
+MODE_ALWAYS = "always"
+
+PROFILE_DEFAULT = "default"
+PROFILE_BULK = "bulk"
+
+# synchronous_commit=off only risks losing the last few commits on a server
+# crash, never consistency; a lost commit is simply re-synced next run.
+BULK_SETTINGS = {
+    "synchronous_commit": "off",
+    "work_mem": "256MB",
+    "maintenance_work_mem": "1GB",
+}
+BULK_SETTINGS.update(json.loads(os.environ.get("SESSION_TUNING_SETTINGS", "{}")))
+
+
+def get_settings(init):
+    settings = dict(BULK_SETTINGS)
+    # Skipping triggers is only safe while the table is being created from a
+    # snapshot; during an incremental a user trigger may be maintaining
+    # something downstream.
+    if init and SESSION_TUNING_REPLICATION_ROLE:
+        settings["session_replication_role"] = "replica"
+    return settings
+
+
+class TunedConnection:
+    """Wraps DatabaseConnection.connection so each session it opens is tuned."""
+
+    def __init__(self, connection, settings, before):
+        self._connection = connection
+        self._settings = settings
+        self._before = before
+        self._context = None
+        self._applied = []
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    async def __aenter__(self):
+        context = await self._connection.__aenter__()
+        for name, value in self._settings.items():
+            if name not in self._before:
+                self._before[name] = await context.query_one(str, f"SELECT current_setting({quote(name)})")
+            try:
+                await context.execute(f"SET {name} = {quote(str(value))}")
+                self._applied.append(name)
+            except Exception as e:
+                # e.g. session_replication_role without rds_superuser
+                logger.warning(f"could not set {name}={value}: {e}")
+        self._context = context
+        return context
+
+    async def __aexit__(self, exc_type, exc, tb):
+        for name in self._applied:
+            try:
+                await self._context.execute(f"RESET {name}")
+            except Exception as e:
+                logger.warning(f"could not reset {name}: {e}")
+        self._context = None
+        self._applied = []
+        return await self._connection.__aexit__(exc_type, exc, tb)
+
+
+async def get_watermark(db_connection, namespace, table_name):
+    async with db_connection.connection as conn:
+        rows = await conn.query_all(
+            datetime.datetime,
+            'SELECT "timestamp" FROM "instructure_dap"."table_sync" '
+            f"WHERE source_namespace = {quote(namespace)} AND source_table = {quote(table_name)}",
+        )
+    return rows[0] if rows else None
+
+
+async def get_rows_changed(db_connection, schema, relation):
+    # Cumulative row writes from the statistics views: cheap, and close enough
+    # for a per-table throughput figure.
+    async with db_connection.connection as conn:
+        rows = await conn.query_all(
+            int,
+            "SELECT n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables "
+            f"WHERE schemaname = {quote(schema)} AND relname = {quote(relation)}",
+        )
+    return rows[0] if rows else 0
+
+
+def publish(namespace, table_name, profile, rows_per_second):
+    try:
+        metrics = EphemeralMetrics()
+        metrics.add_dimension(name="cd2_namespace", value=namespace)
+        metrics.add_dimension(name="table", value=table_name)
+        metrics.add_dimension(name="profile", value=profile)
+        metrics.add_metric(name="RowsPerSecond", unit=MetricUnit.CountPerSecond, value=rows_per_second)
+        metrics.flush_metrics()
+    except Exception as e:
+        logger.exception(f"failed to publish session tuning metrics for {namespace}.{table_name}: {e}")
+
+
+def choose_profile(db_connection, namespace, table_name, init):
+    if SESSION_TUNING == MODE_ALWAYS:
+        return PROFILE_BULK
+    if SESSION_TUNING in (MODE_INIT, MODE_AUTO) and init:
+        return PROFILE_BULK
+    if SESSION_TUNING == MODE_AUTO:
+        try:
+            watermark = asyncio.get_event_loop().run_until_complete(
+                get_watermark(db_connection, namespace, table_name)
+            )
+        except Exception as e:
+            logger.warning(f"could not read watermark for {namespace}.{table_name}: {e}")
+            return PROFILE_DEFAULT
+        if watermark is not None:
+            lag = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - watermark
+            if lag >= datetime.timedelta(hours=SESSION_TUNING_MIN_LAG_HOURS):
+                return PROFILE_BULK
+    return PROFILE_DEFAULT
+
+
+@contextlib.contextmanager
+def tuned(event, db_connection, namespace, table_name, init=False, relation=None, count_rows=True):
+    """Apply the bulk profile to the enclosed replicator call if SESSION_TUNING selects it.
+
+    Records the profile, the settings it replaced and the row throughput in
+    event["session_tuning"] either way (also with SESSION_TUNING off), so
+    tuned and untuned runs of the same table can be compared. Rows are
+    counted on relation, a (schema, table) pair that defaults to the target
+    table; count_rows=False skips counting for calls that write no rows of
+    their own.
+    """
+    schema, relation = relation or (namespace, table_name)
+    profile = choose_profile(db_connection, namespace, table_name, init)
+    settings = get_settings(init) if profile == PROFILE_BULK else {}
+    before = {}
+
+    loop = asyncio.get_event_loop()
+    rows_before = None
+    if count_rows:
+        try:
+            rows_before = loop.run_until_complete(get_rows_changed(db_connection, schema, relation))
+        except Exception as e:
+            logger.warning(f"could not read row statistics for {schema}.{relation}: {e}")
+
+    connection = db_connection.connection
+    if settings:
+        db_connection.connection = TunedConnection(connection, settings, before)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        db_connection.connection = connection
+
+        summary = {
+            "profile": profile,
+            "settings": settings,
+            "settings_before": before,
+            "seconds": round(elapsed, 3),
+        }
+        if rows_before is not None:
+            try:
+                rows = loop.run_until_complete(get_rows_changed(db_connection, schema, relation)) - rows_before
+                summary["rows"] = rows
+                summary["rows_per_second"] = round(rows / elapsed, 1) if elapsed else None
+            except Exception as e:
+                logger.warning(f"could not read row statistics for {schema}.{relation}: {e}")
+            if summary.get("rows_per_second") is not None:
+                publish(namespace, table_name, profile, summary["rows_per_second"])
+
+        event["session_tuning"] = summary
+        logger.info(f"session tuning for {namespace}.{table_name}: {json.dumps(summary)}")
@@ -0,0 +1,280 @@
+import copy
+import datetime
+import os
+
+import aiofiles
+from aws_lambda_powertools import Logger
+from dap.dap_types import SnapshotQuery, Format, Mode
+from dap.replicator import meta_schema
+from dap.replicator.sql_metatable_handler import get_table_meta_record
+from dap.replicator.sql_op import fetch_schema_for_table, get_module_for_namespace
+from dap.replicator.sql_op_init import SqlOpInit
+from pysqlsync.data.exchange import AsyncTextReader
+from pysqlsync.model.data_types import quote
+from pysqlsync.model.id_types import LocalId, QualifiedId
+from strong_typing.serialization import json_dump_string
+
+from table_common import bootstrap
+
+# Sharded initialization for tables too large to init in one Fargate task.
+#
+# SQLReplicator.initialize() downloads every snapshot object and inserts them
+# one after another. Here the work is split in three phases, each run as its
+# own task by the state machine:
+#
+#   prepare  run the snapshot job once, create an empty target table and a
+#            staging table shaped like it in the <namespace>__init_staging
+#            schema, without its constraints
+#   load     (one task per shard) download every Nth snapshot object of the
+#            job and COPY it into the staging table
+#   commit   check that every shard loaded and that the staging row count
+#            matches what the loaders reported, add the target's constraints
+#            to the staging table, then swap it in for the empty target and
+#            write the instructure_dap.table_sync watermark in a single
+#            transaction
+#
+# The staging table is swapped in rather than copied, so commit doesn't
+# rewrite the whole table. Loaders are not retried: a failed shard fails the
+# init, and the next attempt starts over at prepare, which recreates the
+# staging table. Nothing is visible in the target table, and the table is
+# not marked as replicated, until commit succeeds.
+
+logger = Logger()
+
+PHASE_PREPARE = "prepare"
+PHASE_LOAD = "load"
+PHASE_COMMIT = "commit"
+
+STATE_PREPARED = "init_prepared"
+STATE_SHARD_LOADED = "shard_loaded"
+
+# Staging tables live in their own schema, named like their target so that
+# swapping one in is a matter of moving it to the namespace's schema.
+STAGING_SCHEMA_SUFFIX = "__init_staging"
+
+
+def staging_table_id(target):
+    return QualifiedId(f"{target.scope_id}{STAGING_SCHEMA_SUFFIX}", target.local_id)
+
+
+def get_staging_relation(namespace, table_name):
+    """The staging table as a (schema, table) pair, before the table model is loaded."""
+    return f"{namespace}{STAGING_SCHEMA_SUFFIX}", table_name
+
+
+def get_modules(namespace):
+    return [meta_schema, get_module_for_namespace(namespace)]
+
+
+async def create_table(session, explorer, namespace, table_name):
+    """Fetch the table's current schema and create the target table to match.
+
+    Only prepare changes the database schema; see open_table().
+    """
+    entity_type, schema, versioned_schema = await fetch_schema_for_table(
+        session, namespace, table_name
+    )
+    await explorer.synchronize(modules=get_modules(namespace))
+    return entity_type, schema, versioned_schema
+
+
+async def open_table(session, explorer, namespace, table_name, event):
+    """Fetch the table's schema and check it is the one prepare created the tables with.
+
+    The version is checked before anything touches the database, and the
+    database model is only discovered: a schema change between phases
+    must fail the init, not migrate the tables under the loaders.
+    """
+    entity_type, schema, versioned_schema = await fetch_schema_for_table(
+        session, namespace, table_name
+    )
+    check_schema_version(event, versioned_schema)
+    await explorer.discover(modules=get_modules(namespace))
+    return entity_type, schema, versioned_schema
+
+
+def check_schema_version(event, versioned_schema):
+    if versioned_schema.version != event["init_schema_version"]:
+        raise ValueError(
+            f"schema version changed during sharded init "
+            f"(snapshot {event['init_schema_version']}, now {versioned_schema.version}); re-run the init"
+        )
+
+
+async def prepare(credentials, api_base_url, db_connection, namespace, table_name, shard_count):
+    if namespace == "canvas_logs" and table_name == "web_logs":
+        # SQLReplicator upserts web_logs because it can contain duplicate keys;
+        # the plain INSERT in commit() can't, so init it in a single task.
+        raise ValueError("sharded init is not supported for canvas_logs.web_logs")
+
+    async with bootstrap.SharedTokenDAPClient(api_base_url, credentials) as session:
+        async with db_connection.connection as conn:
+            explorer = db_connection.engine.create_explorer(conn)
+            entity_type, schema, versioned_schema = await create_table(
+                session, explorer, namespace, table_name
+            )
+
+            record = await get_table_meta_record(conn, namespace, table_name)
+            if record:
+                raise ValueError("table already replicated, use `syncdb`")
+
+            target = conn.get_table(entity_type)
+            has_rows = await conn.query_one(bool, f"SELECT EXISTS (SELECT 1 FROM {target.name})")
+            if has_rows:
+                raise ValueError(f"table {target.name} is not empty")
+
+            table_data = await session.get_table_data(
+                namespace,
+                table_name,
+                SnapshotQuery(format=Format.TSV, mode=Mode.condensed),
+            )
+
+            # No constraints (so no indexes) while the loaders COPY in
+            # parallel; commit adds them in one pass over the loaded rows.
+            staging = staging_table_id(target.name)
+            await conn.execute(
+                f"CREATE SCHEMA IF NOT EXISTS {LocalId(staging.scope_id)};\n"
+                f"DROP TABLE IF EXISTS {staging};\n"
+                f"CREATE TABLE {staging} (LIKE {target.name} "
+                "INCLUDING COMMENTS INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING IDENTITY INCLUDING STORAGE)"
+            )
+
+    timestamp = table_data.timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    logger.info(
+        f"prepared sharded init of {namespace}.{table_name}: "
+        f"{len(table_data.objects)} objects in {shard_count} shards"
+    )
+
+    return {
+        "init_job_id": table_data.job_id,
+        "init_timestamp": timestamp.isoformat(),
+        "init_schema_version": versioned_schema.version,
+        "init_object_count": len(table_data.objects),
+        "init_shards": list(range(shard_count)),
+    }
+
+
+async def load(credentials, api_base_url, db_connection, namespace, table_name, event, shard):
+    shard_count = len(event["init_shards"])
+
+    async with bootstrap.SharedTokenDAPClient(api_base_url, credentials) as session:
+        async with db_connection.connection as conn:
+            explorer = db_connection.engine.create_explorer(conn)
+            entity_type, schema, versioned_schema = await open_table(
+                session, explorer, namespace, table_name, event
+            )
+
+            staging = copy.copy(conn.get_table(entity_type))
+            staging.name = staging_table_id(staging.name)
+
+            # Sort so every loader sees the same object order and the shards
+            # partition the job's objects exactly.
+            objects = sorted(await session.get_objects(event["init_job_id"]), key=lambda o: o.id)
+            shard_objects = objects[shard::shard_count]
+            logger.info(f"loading shard {shard + 1} of {shard_count}: {len(shard_objects)} objects")
+
+            mapping = SqlOpInit._get_init_tabular_mapping(entity_type)
+            rows = 0
+
+            async def counted(records):
+                nonlocal rows
+                async for record in records:
+                    rows += 1
+                    yield record
+
+            async with aiofiles.tempfile.TemporaryDirectory() as temp_dir:
+                await session.download_objects(shard_objects, temp_dir, decompress=True)
+
+                for filename in sorted(os.listdir(temp_dir)):
+                    if not filename.endswith(".tsv"):
+                        continue
+                    async with aiofiles.open(os.path.join(temp_dir, filename), mode="rb") as f:
+                        reader = AsyncTextReader(f, mapping.labels_to_types)
+                        await reader.read_header()
+                        await conn.insert_rows(
+                            staging,
+                            field_names=tuple(mapping.labels_to_fields[c] for c in reader.columns),
+                            field_types=reader.field_types,
+                            records=counted(reader.records()),
+                        )
+
+    return {"objects": len(shard_objects), "rows": rows}
+
+
+async def commit(credentials, api_base_url, db_connection, namespace, table_name, event, shard_results):
+    expected_shards = set(event["init_shards"])
+    loaded = {
+        r["shard"]: r for r in shard_results if r.get("state") == STATE_SHARD_LOADED
+    }
+    missing = expected_shards - set(loaded)
+    if missing:
+        raise ValueError(f"shards not loaded: {sorted(missing)}")
+
+    loaded_objects = sum(r["objects"] for r in loaded.values())
+    if loaded_objects != event["init_object_count"]:
+        raise ValueError(
+            f"shards loaded {loaded_objects} objects, snapshot has {event['init_object_count']}"
+        )
+
+    async with bootstrap.SharedTokenDAPClient(api_base_url, credentials) as session:
+        async with db_connection.connection as conn:
+            explorer = db_connection.engine.create_explorer(conn)
+            entity_type, schema, versioned_schema = await open_table(
+                session, explorer, namespace, table_name, event
+            )
+
+            record = await get_table_meta_record(conn, namespace, table_name)
+            if record:
+                raise ValueError("table already replicated, use `syncdb`")
+
+            target = conn.get_table(entity_type)
+            staging = staging_table_id(target.name)
+
+            total_rows = await conn.query_one(int, f"SELECT COUNT(*) FROM {staging}")
+            reported_rows = sum(r["rows"] for r in loaded.values())
+            if total_rows != reported_rows:
+                raise ValueError(f"shards reported {reported_rows} rows, staging has {total_rows}")
+
+            # pysqlsync only gives the tables it creates constraints (the
+            # primary key) and a comment; copy both over under the target's
+            # names so the swapped-in table matches what it would create.
+            # NOT NULL came with the LIKE in prepare.
+            constraints = await conn.query_all(
+                tuple[str, str],
+                "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                f"WHERE conrelid = {quote(str(target.name))}::regclass AND contype IN ('p', 'u', 'f', 'c', 'x') "
+                "ORDER BY contype <> 'p', conname",
+            )
+            comment = await conn.query_one(
+                str, f"SELECT COALESCE(obj_description({quote(str(target.name))}::regclass, 'pg_class'), '')"
+            )
+            statements = [
+                f"ALTER TABLE {staging} ADD CONSTRAINT {LocalId(name)} {definition}"
+                for name, definition in constraints
+            ]
+            if comment:
+                statements.append(f"COMMENT ON TABLE {staging} IS {quote(comment)}")
+
+            meta_table = conn.get_table(meta_schema.table_sync)
+
+            # A multi-statement string without explicit BEGIN/COMMIT runs as a
+            # single implicit transaction, so the constraints, the table and
+            # the watermark land together or not at all, and a failed commit
+            # can simply be re-run. The target is the empty table prepare
+            # created; nothing else can have written to it.
+            statements += [
+                f"DROP TABLE {target.name}",
+                f"ALTER TABLE {staging} SET SCHEMA {LocalId(target.name.scope_id)}",
+                f"INSERT INTO {meta_table.name} "
+                "(source_namespace, source_table, timestamp, schema_version, target_schema, target_table, "
+                "schema_description_format, schema_description) "
+                f"VALUES ({quote(namespace)}, {quote(table_name)}, {quote(event['init_timestamp'])}, "
+                f"{versioned_schema.version}, {quote(namespace)}, {quote(table_name)}, "
+                f"'json', {quote(json_dump_string(schema))})",
+            ]
+            await conn.execute(";\n".join(statements))
+            await conn.execute(f"ANALYZE {target.name}")
+
+    logger.info(f"committed sharded init of {namespace}.{table_name}: {total_rows} rows")
+
+    return total_rows
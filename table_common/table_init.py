@@ -0,0 +1,88 @@
+import asyncio
+import os
+
+from aws_lambda_powertools import Logger
+from dap.replicator.sql import SQLReplicator
+
+from table_common import bootstrap, profiling, resource_usage, session_tuning, sharded_init
+
+# Table initialization, run by init_table/app.py in its own task and by the
+# table workers (sync_table/worker.py) for init jobs.
+
+logger = Logger()
+
+
+def init(event, credentials, db_connection, namespace, api_base_url, phase=None, shard=None, shard_results=None):
+    """Initialize event["table_name"], or run one phase of a sharded init.
+
+    phase is one of the sharded_init phases, or None for a regular
+    single-task init. Returns the event with its state set; errors are
+    logged and reported as state "failed".
+    """
+    table_name = event['table_name']
+    logger.info(f"initting table: {table_name}")
+
+    os.chdir("/tmp/")
+
+    try:
+        # Sharded phases are recorded separately (e.g. init_load) so they don't
+        # skew the size recommended for a regular single-task init.
+        operation = f"init_{phase}" if phase else "init"
+        # Loaders write to the staging table. Prepare and commit write no
+        # rows of their own (commit swaps the loaded staging table in).
+        relation = None
+        if phase == sharded_init.PHASE_LOAD:
+            relation = sharded_init.get_staging_relation(namespace, table_name)
+        with resource_usage.measured(event, namespace, table_name, operation), \
+                profiling.profiled(event, namespace, table_name), \
+                session_tuning.tuned(
+                    event, db_connection, namespace, table_name, init=True,
+                    relation=relation, count_rows=phase in (None, sharded_init.PHASE_LOAD),
+                ):
+            if phase == sharded_init.PHASE_PREPARE:
+                event.update(asyncio.get_event_loop().run_until_complete(
+                    sharded_init.prepare(credentials, api_base_url, db_connection, namespace, table_name, event['init_shard_count'])
+                ))
+                event['state'] = sharded_init.STATE_PREPARED
+
+            elif phase == sharded_init.PHASE_LOAD:
+                # Set up front so the state machine can select them even if the load fails.
+                event['init_shard'] = shard
+                event['init_shard_rows'] = None
+                event['init_shard_objects'] = None
+                result = asyncio.get_event_loop().run_until_complete(
+                    sharded_init.load(credentials, api_base_url, db_connection, namespace, table_name, event, shard)
+                )
+                event['init_shard_rows'] = result['rows']
+                event['init_shard_objects'] = result['objects']
+                event['state'] = sharded_init.STATE_SHARD_LOADED
+
+            elif phase == sharded_init.PHASE_COMMIT:
+                event['init_rows'] = asyncio.get_event_loop().run_until_complete(
+                    sharded_init.commit(credentials, api_base_url, db_connection, namespace, table_name, event, shard_results)
+                )
+                event['state'] = 'complete'
+
+            else:
+                asyncio.get_event_loop().run_until_complete(
+                    init_table(credentials, api_base_url, db_connection, namespace, table_name)
+                )
+                event['state'] = 'complete'
+
+        # Remove the error message from the sync_table job because it is not necessary after the successful table initialization.
+        if event['state'] == 'complete' and "error_message" in event and "sync_table - needs_init" in event["error_message"]:
+            del event["error_message"]
+
+    except Exception as e:
+        logger.exception(e)
+        event['state'] = 'failed'
+        return event
+
+    logger.info(f"event: {event}")
+
+    return event
+
+
+async def init_table(credentials, api_base_url, db_connection, namespace, table_name):
+    async with bootstrap.SharedTokenDAPClient(api_base_url, credentials) as session:
+        await SQLReplicator(session, db_connection).initialize(namespace, table_name)
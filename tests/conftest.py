@@ -0,0 +1,74 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# The task code isn't packaged: each image runs its directory's modules with
+# table_common/ next to them, so put the same directories on the path here.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "sync_table"), os.path.join(ROOT, "list_tables")):
+    if path not in sys.path:
+        sys.path.append(path)
+
+# Module-level boto3 clients need a region; nothing here talks to AWS.
+os.environ.setdefault("AWS_REGION", "ca-central-1")
+os.environ.setdefault("AWS_DEFAULT_REGION", "ca-central-1")
+os.environ.setdefault("POWERTOOLS_METRICS_NAMESPACE", "canvas-data-2")
+
+
+@pytest.fixture(autouse=True)
+def event_loop():
+    # The task code calls asyncio.get_event_loop() from the main thread, which
+    # fails once another test's asyncio.run() has closed and unset the loop.
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+class StubContext:
+    """An async context manager that yields value."""
+
+    def __init__(self, value):
+        self.value = value
+
+    async def __aenter__(self):
+        return self.value
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class StubConnection:
+    """Stands in for a pysqlsync connection.
+
+    Statements passed to execute() are recorded, and raise if fail(statement)
+    is true; queries are answered by answer(statement).
+    """
+
+    def __init__(self, answer=lambda statement: [], fail=lambda statement: False):
+        self.answer = answer
+        self.fail = fail
+        self.statements = []
+
+    async def execute(self, statement):
+        if self.fail(statement):
+            raise RuntimeError(f"failed: {statement}")
+        self.statements.append(statement)
+
+    async def query_one(self, signature, statement):
+        return self.answer(statement)
+
+    async def query_all(self, signature, statement):
+        return self.answer(statement)
+
+
+class StubDatabase:
+    """Enough of dap's DatabaseConnection: .connection opens conn."""
+
+    def __init__(self, conn=None, engine=None):
+        self.conn = conn or StubConnection()
+        self.connection = StubContext(self.conn)
+        self.engine = engine
@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import time
+
+import jwt
+import pytest
+
+from table_common import bootstrap
+
+PARAM_PATH = "/dev/canvas_data_2"
+SECRET_NAME = "cd2-db-user"
+CLIENT_ID = "us-east-1#client"
+DB_USER_SECRET = {"username": "canvas", "password": "p", "dbname": "cd2", "host": "db", "port": 5432}
+
+
+def make_token(expires_in):
+    return jwt.encode({"exp": int(time.time()) + expires_in}, "k" * 32, algorithm="HS256")
+
+
+class StubSSM:
+    def __init__(self, barrier=None):
+        self.calls = 0
+        self.barrier = barrier
+
+    def get_multiple(self, path, **kwargs):
+        assert path == PARAM_PATH
+        self.calls += 1
+        if self.barrier:
+            self.barrier.wait()
+        return {"dap_client_id": CLIENT_ID, "dap_client_secret": "secret"}
+
+
+class StubSecrets:
+    def __init__(self, barrier=None):
+        self.calls = 0
+        self.barrier = barrier
+
+    def __call__(self, name):
+        assert name == SECRET_NAME
+        self.calls += 1
+        if self.barrier:
+            self.barrier.wait()
+        return dict(DB_USER_SECRET)
+
+
+class StubDAP:
+    def __init__(self, expires_in=3600):
+        self.calls = 0
+        self.expires_in = expires_in
+
+    def __call__(self, api_base_url, credentials):
+        assert credentials.client_id == CLIENT_ID
+        self.calls += 1
+        return make_token(self.expires_in)
+
+
+class RecordingCache:
+    def __init__(self):
+        self.items = {}
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None or item[1] <= time.time():
+            return None
+        return item[0]
+
+    def put(self, key, value, expires_at):
+        self.items[key] = (value, expires_at)
+
+
+class BrokenCache:
+    def get(self, key):
+        raise RuntimeError("cache unavailable")
+
+    def put(self, key, value, expires_at):
+        raise RuntimeError("cache unavailable")
+
+
+@pytest.fixture(autouse=True)
+def run_id(monkeypatch):
+    monkeypatch.setattr(bootstrap, "RUN_ID", "exec-1")
+    monkeypatch.setattr(bootstrap, "access_tokens", {})
+
+
+def start(cache, ssm=None, secrets=None, dap=None, **kwargs):
+    return bootstrap.start(
+        "canvas",
+        "https://dap.invalid",
+        PARAM_PATH,
+        SECRET_NAME,
+        ssm_provider=ssm or StubSSM(),
+        get_secret=secrets or StubSecrets(),
+        authenticate=dap or StubDAP(),
+        cache=cache,
+        **kwargs,
+    )
+
+
+def test_miss_then_hit(tmp_path):
+    cache = bootstrap.FileCache(str(tmp_path))
+    ssm, secrets, dap = StubSSM(), StubSecrets(), StubDAP()
+
+    first = start(cache, ssm, secrets, dap)
+    second = start(cache, ssm, secrets, dap)
+
+    assert (ssm.calls, secrets.calls, dap.calls) == (1, 1, 1)
+    assert set(first.summary["sources"].values()) == {"fetched"}
+    assert set(second.summary["sources"].values()) == {"cache"}
+    assert second.credentials.client_id == CLIENT_ID
+    assert second.db_user_secret == DB_USER_SECRET
+    assert bootstrap.access_tokens[CLIENT_ID]
+
+
+def test_lookups_run_concurrently():
+    # Both stubs block until the other one has been called as well.
+    barrier = threading.Barrier(2, timeout=5)
+    result = start(RecordingCache(), StubSSM(barrier), StubSecrets(barrier), get_log_url=lambda: "https://log")
+
+    assert result.db_user_secret == DB_USER_SECRET
+    assert result.cloudwatch_log_url == "https://log"
+
+
+def test_token_cached_until_shortly_before_expiry():
+    cache = RecordingCache()
+    token = make_token(600)
+    start(cache, dap=lambda url, credentials: token)
+
+    _, expires_at = cache.items[f"exec-1/access_token:{CLIENT_ID}"]
+    assert expires_at == bootstrap.get_token_expiry(token) - bootstrap.TOKEN_EXPIRY_MARGIN_SECONDS
+    _, secret_expires_at = cache.items[f"exec-1/secret:{SECRET_NAME}"]
+    assert secret_expires_at > expires_at
+
+
+def test_expiring_token_is_not_cached():
+    cache = RecordingCache()
+    start(cache, dap=StubDAP(expires_in=bootstrap.TOKEN_EXPIRY_MARGIN_SECONDS - 60))
+
+    assert f"exec-1/access_token:{CLIENT_ID}" not in cache.items
+
+
+def test_expired_entries_are_fetched_again(tmp_path):
+    cache = bootstrap.FileCache(str(tmp_path))
+    cache.put(f"exec-1/secret:{SECRET_NAME}", {"username": "stale"}, time.time() - 1)
+    secrets = StubSecrets()
+
+    result = start(cache, secrets=secrets)
+
+    assert secrets.calls == 1
+    assert result.db_user_secret == DB_USER_SECRET
+
+
+def test_broken_cache_falls_back_to_fetching():
+    ssm, secrets, dap = StubSSM(), StubSecrets(), StubDAP()
+
+    result = start(BrokenCache(), ssm, secrets, dap)
+
+    assert (ssm.calls, secrets.calls, dap.calls) == (1, 1, 1)
+    assert result.db_user_secret == DB_USER_SECRET
+
+
+def test_cache_is_off_without_run_id(monkeypatch):
+    monkeypatch.setattr(bootstrap, "RUN_ID", None)
+    assert isinstance(bootstrap.get_cache(), bootstrap.NullCache)
+
+
+async def open_session(credentials):
+    client = bootstrap.SharedTokenDAPClient("https://dap.invalid", credentials)
+    session = await client.__aenter__()
+    try:
+        return session._access_token, session._session.headers.get("Authorization")
+    finally:
+        await client.__aexit__(None, None, None)
+
+
+@pytest.mark.parametrize("expires_in, seeded", [(3600, True), (60, False)])
+def test_shared_token_client_seeds_fresh_tokens_only(expires_in, seeded):
+    result = start(RecordingCache(), dap=StubDAP(expires_in=expires_in))
+
+    access_token, authorization = asyncio.run(open_session(result.credentials))
+
+    if seeded:
+        assert str(access_token) == bootstrap.access_tokens[CLIENT_ID]
+        assert authorization == f"Bearer {access_token}"
+    else:
+        assert access_token is None
+        assert authorization is None
@@ -0,0 +1,31 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def list_tables():
+    # list_tables/app.py shares its module name with sync_table/app.py, and
+    # imports shared.utils from the Lambda layer.
+    sys.path.append(os.path.join(ROOT, "lambda-layers", "python"))
+    os.environ.setdefault("ALERTS_HIGH_TOPIC_ARN", "arn:aws:sns:ca-central-1:000000000000:alerts")
+    os.environ.setdefault("STACK_NAME", "cd2-test")
+    spec = importlib.util.spec_from_file_location("list_tables_app", os.path.join(ROOT, "list_tables", "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("", {}),
+    ("submissions:8, quiz_submissions:4", {"submissions": 8, "quiz_submissions": 4}),
+    ("submissions:8,courses:1", {"submissions": 8}),
+    ("submissions,quizzes:x,a:b:c,,users:2", {"users": 2}),
+])
+def test_get_init_shards(list_tables, monkeypatch, value, expected):
+    monkeypatch.setenv("INIT_SHARD_TABLES", value)
+    assert list_tables.get_init_shards() == expected
@@ -0,0 +1,132 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import types
+
+import pytest
+
+from table_common import profiling
+
+
+@pytest.fixture
+def profile_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "PROFILE_TABLES", ["submissions"])
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(profiling, "PROFILE_S3_BUCKET", None)
+    monkeypatch.setattr(profiling, "PROFILE_INTERVAL_SECONDS", 0.001)
+    return tmp_path
+
+
+def spin(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+async def fetch(seconds):
+    await asyncio.sleep(seconds)
+
+
+async def replicate():
+    # Stands in for the replicator: runs a few tasks and keeps the thread busy.
+    await asyncio.gather(fetch(0.01), fetch(0.02))
+    spin(0.05)
+
+
+def test_sampler_attributes_samples_to_the_busy_function():
+    sampler = profiling.Sampler(threading.get_ident(), 0.001)
+    sampler.start()
+    spin(0.1)
+    sampler.stop()
+
+    assert sampler.samples > 0
+    [top] = sampler.top(1)
+    assert top["function"].startswith("spin (")
+    assert top["total_pct"] >= top["self_pct"] > 0
+    assert any(stack.endswith(top["function"]) for stack in sampler.stacks)
+
+
+def test_sampler_without_samples_has_no_top():
+    assert profiling.Sampler(threading.get_ident(), 1).top(5) == []
+
+
+def test_task_timer_chains_and_restores_the_task_factory(event_loop):
+    created = []
+
+    def factory(loop, coro, **kwargs):
+        created.append(coro.__qualname__)
+        return asyncio.Task(coro, loop=loop, **kwargs)
+
+    event_loop.set_task_factory(factory)
+    timer = profiling.TaskTimer(event_loop)
+    timer.start()
+    event_loop.run_until_complete(replicate())
+    timer.stop()
+
+    assert event_loop.get_task_factory() is factory
+    assert created.count("fetch") == 2
+    timings = {timing["task"]: timing for timing in timer.top(5)}
+    assert set(timings) == {"replicate", "fetch"}
+    assert timings["fetch"]["count"] == 2
+    assert timings["fetch"]["total_seconds"] >= timings["fetch"]["max_seconds"] >= 0.02
+
+
+def test_profiled_writes_the_profile_and_a_short_summary(monkeypatch, profile_dir, event_loop):
+    monkeypatch.setattr(profiling, "PROFILE_EVENT_TOP_N", 1)
+    event = {}
+
+    with profiling.profiled(event, "canvas", "submissions"):
+        event_loop.run_until_complete(replicate())
+
+    assert event_loop.get_task_factory() is None
+    summary = event["profile"]
+    assert set(summary) == {"elapsed_seconds", "samples", "top_functions", "path"}
+    assert summary["samples"] > 0
+    assert len(summary["top_functions"]) == 1
+    assert os.path.dirname(summary["path"]) == str(profile_dir)
+    with open(summary["path"]) as f:
+        profile = json.load(f)
+    assert profile["samples"] == summary["samples"]
+    assert profile["stacks"]
+    assert {task["task"] for task in profile["top_tasks"]} == {"replicate", "fetch"}
+
+
+def test_profiled_summarizes_calls_that_raise(profile_dir, event_loop):
+    event = {}
+
+    with pytest.raises(RuntimeError):
+        with profiling.profiled(event, "canvas", "submissions"):
+            spin(0.02)
+            raise RuntimeError("replication failed")
+
+    assert event_loop.get_task_factory() is None
+    assert os.path.exists(event["profile"]["path"])
+
+
+def test_profiled_uploads_to_s3(monkeypatch, profile_dir):
+    uploads = []
+    s3 = types.SimpleNamespace(upload_file=lambda path, bucket, key: uploads.append((path, bucket, key)))
+    monkeypatch.setattr(profiling.boto3, "client", lambda service: s3)
+    monkeypatch.setattr(profiling, "PROFILE_S3_BUCKET", "profiles-bucket")
+    event = {}
+
+    with profiling.profiled(event, "canvas", "submissions"):
+        pass
+
+    [(path, bucket, key)] = uploads
+    assert path == event["profile"]["path"]
+    assert event["profile"]["s3_uri"] == f"s3://{bucket}/{key}"
+    assert key.startswith("profiles/profile-canvas.submissions-")
+
+
+def test_other_tables_are_not_profiled(profile_dir, event_loop):
+    event = {}
+
+    with profiling.profiled(event, "canvas", "users"):
+        assert event_loop.get_task_factory() is None
+        event_loop.run_until_complete(replicate())
+
+    assert event == {}
+    assert os.listdir(profile_dir) == []
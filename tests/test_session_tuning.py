@@ -0,0 +1,184 @@
+import asyncio
+import datetime
+import json
+
+import pytest
+
+from conftest import StubConnection, StubDatabase
+from table_common import session_tuning
+
+
+class StatisticsConnection(StubConnection):
+    """Answers the row statistics with counts in turn and the watermark query with watermark."""
+
+    def __init__(self, counts, watermark=None, fail=lambda statement: False):
+        super().__init__(self.answer_query, fail)
+        self.counts = iter(counts)
+        self.watermark = watermark
+        self.queries = []
+
+    def answer_query(self, statement):
+        self.queries.append(statement)
+        if "pg_stat_user_tables" in statement:
+            return [next(self.counts)]
+        if "current_setting" in statement:
+            return "previous"
+        if "table_sync" in statement:
+            if isinstance(self.watermark, Exception):
+                raise self.watermark
+            return [self.watermark] if self.watermark else []
+        raise AssertionError(f"unexpected query: {statement}")
+
+
+def make_db(counts=(0, 0), **kwargs):
+    return StubDatabase(StatisticsConnection(counts, **kwargs))
+
+
+@pytest.fixture(autouse=True)
+def tuning_off(monkeypatch):
+    monkeypatch.setattr(session_tuning, "SESSION_TUNING", session_tuning.MODE_OFF)
+    monkeypatch.setattr(session_tuning, "SESSION_TUNING_REPLICATION_ROLE", False)
+
+
+def tuning(monkeypatch, mode, replication_role=False):
+    monkeypatch.setattr(session_tuning, "SESSION_TUNING", mode)
+    monkeypatch.setattr(session_tuning, "SESSION_TUNING_REPLICATION_ROLE", replication_role)
+
+
+def replicate(db):
+    # What the replicator does: open a session on db.connection and write to it.
+    async def copy():
+        async with db.connection as conn:
+            await conn.execute("COPY submissions")
+
+    asyncio.get_event_loop().run_until_complete(copy())
+
+
+def get_rows_per_second(capsys):
+    emfs = [json.loads(line) for line in capsys.readouterr().out.splitlines() if '"_aws"' in line]
+    return [emf for emf in emfs if "RowsPerSecond" in emf]
+
+
+def test_untuned_runs_are_measured_as_the_baseline(capsys):
+    db = make_db([100, 600])
+    event = {}
+
+    with session_tuning.tuned(event, db, "canvas", "submissions"):
+        replicate(db)
+
+    assert db.conn.statements == ["COPY submissions"]
+    assert event["session_tuning"]["profile"] == session_tuning.PROFILE_DEFAULT
+    assert event["session_tuning"]["settings"] == {}
+    assert event["session_tuning"]["rows"] == 500
+    [emf] = get_rows_per_second(capsys)
+    assert (emf["cd2_namespace"], emf["table"], emf["profile"]) == ("canvas", "submissions", "default")
+    assert emf["_aws"]["CloudWatchMetrics"][0]["Dimensions"][0][:3] == ["cd2_namespace", "table", "profile"]
+
+
+def test_rows_are_counted_on_the_relation_written_to(capsys):
+    db = make_db([0, 10])
+    event = {}
+
+    with session_tuning.tuned(event, db, "canvas", "submissions", relation=("canvas__init_staging", "submissions")):
+        pass
+
+    assert all("schemaname = 'canvas__init_staging'" in s for s in db.conn.queries)
+    assert event["session_tuning"]["rows"] == 10
+
+
+def test_rows_not_counted_for_calls_that_write_none(capsys):
+    db = make_db([])
+    event = {}
+
+    with session_tuning.tuned(event, db, "canvas", "submissions", count_rows=False):
+        pass
+
+    assert "rows" not in event["session_tuning"]
+    assert get_rows_per_second(capsys) == []
+
+
+def test_bulk_settings_wrap_the_replicator_session(monkeypatch, capsys):
+    tuning(monkeypatch, session_tuning.MODE_INIT)
+    db = make_db([0, 1000])
+    connection = db.connection
+    event = {}
+
+    with session_tuning.tuned(event, db, "canvas", "submissions", init=True):
+        replicate(db)
+
+    settings = session_tuning.BULK_SETTINGS
+    assert db.conn.statements == (
+        [f"SET {name} = '{value}'" for name, value in settings.items()]
+        + ["COPY submissions"]
+        + [f"RESET {name}" for name in settings]
+    )
+    assert db.connection is connection
+    assert event["session_tuning"]["profile"] == session_tuning.PROFILE_BULK
+    assert event["session_tuning"]["settings_before"] == {name: "previous" for name in settings}
+    [emf] = get_rows_per_second(capsys)
+    assert emf["profile"] == "bulk"
+
+
+def test_incrementals_are_not_tuned_in_init_mode(monkeypatch):
+    tuning(monkeypatch, session_tuning.MODE_INIT)
+    db = make_db()
+    event = {}
+
+    with session_tuning.tuned(event, db, "canvas", "submissions"):
+        replicate(db)
+
+    assert db.conn.statements == ["COPY submissions"]
+    assert event["session_tuning"]["profile"] == session_tuning.PROFILE_DEFAULT
+
+
+@pytest.mark.parametrize("init, applied", [(True, True), (False, False)])
+def test_replication_role_is_set_for_inits_only(monkeypatch, init, applied):
+    tuning(monkeypatch, session_tuning.MODE_ALWAYS, replication_role=True)
+    db = make_db()
+
+    with session_tuning.tuned({}, db, "canvas", "submissions", init=init):
+        replicate(db)
+
+    assert ("SET session_replication_role = 'replica'" in db.conn.statements) == applied
+    assert ("RESET session_replication_role" in db.conn.statements) == applied
+
+
+def test_failed_settings_are_skipped(monkeypatch):
+    tuning(monkeypatch, session_tuning.MODE_INIT, replication_role=True)
+    db = make_db(fail=lambda statement: statement.startswith("SET session_replication_role"))
+    event = {}
+
+    with session_tuning.tuned(event, db, "canvas", "submissions", init=True):
+        replicate(db)
+
+    assert "COPY submissions" in db.conn.statements
+    assert "SET synchronous_commit = 'off'" in db.conn.statements
+    assert "RESET synchronous_commit" in db.conn.statements
+    assert not any("session_replication_role" in s for s in db.conn.statements)
+    assert event["session_tuning"]["profile"] == session_tuning.PROFILE_BULK
+
+
+def hours_ago(hours):
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(hours=hours)
+
+
+@pytest.mark.parametrize(
+    "watermark, profile",
+    [
+        (hours_ago(48), session_tuning.PROFILE_BULK),
+        (hours_ago(1), session_tuning.PROFILE_DEFAULT),
+        (None, session_tuning.PROFILE_DEFAULT),
+        (RuntimeError("no table_sync"), session_tuning.PROFILE_DEFAULT),
+    ],
+)
+def test_auto_mode_tunes_incrementals_by_watermark_lag(monkeypatch, watermark, profile):
+    tuning(monkeypatch, session_tuning.MODE_AUTO)
+    monkeypatch.setattr(session_tuning, "SESSION_TUNING_MIN_LAG_HOURS", 24)
+    db = make_db(watermark=watermark)
+    event = {}
+
+    with session_tuning.tuned(event, db, "canvas", "submissions"):
+        replicate(db)
+
+    assert event["session_tuning"]["profile"] == profile
+    assert ("SET synchronous_commit = 'off'" in db.conn.statements) == (profile == session_tuning.PROFILE_BULK)
@@ -0,0 +1,131 @@
+import asyncio
+import types
+
+import pytest
+from pysqlsync.model.id_types import QualifiedId
+
+from conftest import StubConnection, StubContext, StubDatabase
+from table_common import sharded_init
+
+
+class StubExplorer:
+    def __init__(self):
+        self.calls = []
+
+    async def discover(self, *, modules):
+        self.calls.append("discover")
+
+    async def synchronize(self, *, modules):
+        self.calls.append("synchronize")
+
+
+@pytest.fixture
+def schema_version(monkeypatch):
+    version = types.SimpleNamespace(value=3)
+
+    async def fetch_schema_for_table(session, namespace, table_name):
+        return "entity", {"type": "object"}, types.SimpleNamespace(version=version.value)
+
+    monkeypatch.setattr(sharded_init, "fetch_schema_for_table", fetch_schema_for_table)
+    monkeypatch.setattr(sharded_init, "get_module_for_namespace", lambda namespace: types.ModuleType(namespace))
+    return version
+
+
+def test_only_prepare_changes_the_schema(schema_version):
+    explorer = StubExplorer()
+
+    asyncio.run(sharded_init.create_table(None, explorer, "canvas", "submissions"))
+    asyncio.run(sharded_init.open_table(None, explorer, "canvas", "submissions", {"init_schema_version": 3}))
+
+    assert explorer.calls == ["synchronize", "discover"]
+
+
+def test_schema_version_is_checked_before_touching_the_database(schema_version):
+    explorer = StubExplorer()
+    schema_version.value = 4
+
+    with pytest.raises(ValueError, match="schema version changed"):
+        asyncio.run(sharded_init.open_table(None, explorer, "canvas", "submissions", {"init_schema_version": 3}))
+
+    assert explorer.calls == []
+
+
+class StagingConnection(StubConnection):
+    def __init__(self, staging_rows):
+        super().__init__(self.answer_query)
+        self.staging_rows = staging_rows
+
+    def get_table(self, entity_type):
+        if entity_type == "entity":
+            return types.SimpleNamespace(name=QualifiedId("canvas", "submissions"))
+        return types.SimpleNamespace(name=QualifiedId("instructure_dap", "table_sync"))
+
+    def answer_query(self, statement):
+        if "COUNT(*)" in statement:
+            return self.staging_rows
+        if "pg_constraint" in statement:
+            return [("pk_submissions", "PRIMARY KEY (id)")]
+        return "Submissions"
+
+
+@pytest.fixture
+def database(monkeypatch, schema_version):
+    async def get_table_meta_record(conn, namespace, table_name):
+        return None
+
+    monkeypatch.setattr(sharded_init, "get_table_meta_record", get_table_meta_record)
+    monkeypatch.setattr(sharded_init.bootstrap, "SharedTokenDAPClient", lambda url, credentials: StubContext(None))
+
+    def connect(staging_rows):
+        conn = StagingConnection(staging_rows)
+        engine = types.SimpleNamespace(create_explorer=lambda conn: StubExplorer())
+        return conn, StubDatabase(conn, engine)
+
+    return connect
+
+
+EVENT = {
+    "init_shards": [0, 1],
+    "init_object_count": 3,
+    "init_schema_version": 3,
+    "init_timestamp": "2026-01-01T00:00:00",
+}
+SHARD_RESULTS = [
+    {"shard": 0, "state": sharded_init.STATE_SHARD_LOADED, "rows": 10, "objects": 2},
+    {"shard": 1, "state": sharded_init.STATE_SHARD_LOADED, "rows": 5, "objects": 1},
+]
+
+
+def commit(db_connection):
+    return asyncio.run(
+        sharded_init.commit(None, "https://dap.invalid", db_connection, "canvas", "submissions", EVENT, SHARD_RESULTS)
+    )
+
+
+def test_commit_swaps_the_staging_table_in(database):
+    conn, db_connection = database(15)
+
+    assert commit(db_connection) == 15
+
+    # Constraints and swap in one implicit transaction, so a failed swap
+    # leaves nothing behind on staging for the re-run to trip over.
+    swap, analyze = conn.statements
+    swap = swap.split(";\n")
+    assert swap[0] == (
+        'ALTER TABLE "canvas__init_staging"."submissions" ADD CONSTRAINT "pk_submissions" PRIMARY KEY (id)'
+    )
+    assert swap[1].startswith('COMMENT ON TABLE "canvas__init_staging"."submissions"')
+    assert swap[2] == 'DROP TABLE "canvas"."submissions"'
+    assert swap[3] == 'ALTER TABLE "canvas__init_staging"."submissions" SET SCHEMA "canvas"'
+    assert swap[4].startswith('INSERT INTO "instructure_dap"."table_sync"')
+    assert "SELECT" not in swap[2] + swap[3]
+    assert analyze == 'ANALYZE "canvas"."submissions"'
+
+
+def test_commit_refuses_a_short_staging_table(database):
+    conn, db_connection = database(14)
+
+    with pytest.raises(ValueError, match="shards reported 15 rows, staging has 14"):
+        commit(db_connection)
+
+    assert conn.statements == []
@@ -0,0 +1,103 @@
+import json
+import time
+
+import pytest
+
+import sizing
+from table_common import resource_usage
+
+
+def get_emf(capsys):
+    return [json.loads(line) for line in capsys.readouterr().out.splitlines() if '"_aws"' in line]
+
+
+def get_metric_names(emf):
+    return {m["Name"] for m in emf["_aws"]["CloudWatchMetrics"][0]["Metrics"]}
+
+
+@pytest.fixture(autouse=True)
+def tmp_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(resource_usage, "TMP_DIR", str(tmp_path))
+
+
+@pytest.mark.parametrize("service, operation", [
+    ("sync_table", "sync"),
+    ("init_table", "init"),
+    ("init_table", "init_load"),
+])
+def test_query_dimensions_match_published_metrics(monkeypatch, capsys, service, operation):
+    monkeypatch.setenv("POWERTOOLS_SERVICE_NAME", service)
+
+    with resource_usage.measured({}, "canvas", "submissions", operation):
+        pass
+
+    queried = {d["Name"]: d["Value"] for d in sizing.get_metric_dimensions("canvas", "submissions", operation)}
+    emfs = get_emf(capsys)
+    assert emfs
+    for emf in emfs:
+        names = emf["_aws"]["CloudWatchMetrics"][0]["Dimensions"][0]
+        assert {name: emf[name] for name in names} == queried
+
+
+def test_worker_runs_are_not_queried():
+    assert "table_worker" not in sizing.SERVICES.values()
+
+
+def test_peaks_are_published_while_running(monkeypatch, capsys):
+    monkeypatch.setattr(resource_usage, "RESOURCE_SAMPLE_SECONDS", 0.01)
+    monkeypatch.setattr(resource_usage, "RESOURCE_PUBLISH_SECONDS", 0.01)
+
+    event = {}
+    with resource_usage.measured(event, "canvas", "submissions", "sync"):
+        time.sleep(0.2)
+        # What a task that gets killed here would have left behind
+        published = [get_metric_names(emf) for emf in get_emf(capsys)]
+
+    assert published[0] == {"RunsStarted"}
+    assert {"PeakMemoryMB", "PeakTmpGB"} in published
+    assert {"CpuSeconds", "WallSeconds"} <= get_metric_names(get_emf(capsys)[-1])
+    assert event["resource_usage"]["peak_memory_mb"] > 0
+
+
+def test_recommend_keeps_default_until_enough_runs():
+    usage = {"PeakMemoryMB": 500, "PeakTmpGB": 1, "CpuSeconds": 10, "WallSeconds": 100, "Runs": 1, "RunsStarted": 1}
+    assert sizing.recommend(usage)["name"] == sizing.DEFAULT_CLASS
+    assert sizing.recommend({**usage, "Runs": 3, "RunsStarted": 3})["name"] == "small"
+    assert sizing.recommend({**usage, "PeakMemoryMB": 10000})["name"] == "xlarge"
+
+
+def test_recommend_goes_up_after_unfinished_runs():
+    usage = {"PeakMemoryMB": 500, "PeakTmpGB": 1, "CpuSeconds": 10, "WallSeconds": 100, "Runs": 3, "RunsStarted": 4}
+    assert sizing.recommend(usage)["name"] == "medium"
+    # Killed before anything but RunsStarted was published
+    assert sizing.recommend({"RunsStarted": 1})["name"] == "xlarge"
+    assert sizing.recommend({**usage, "PeakMemoryMB": 10000})["name"] == "xlarge"
+
+
+def test_storage_is_read_from_the_volume_not_walked(monkeypatch, tmp_path):
+    def walk(*args, **kwargs):
+        raise AssertionError("os.walk called")
+
+    monkeypatch.setattr(resource_usage.os, "walk", walk)
+    monitor = resource_usage.ResourceMonitor(60)
+    monitor.sample()
+
+    assert monitor.peak_tmp == pytest.approx(resource_usage.shutil.disk_usage(str(tmp_path)).used, rel=0.01)
+
+
+def test_tables_only_carry_sizes_for_their_operations(monkeypatch):
+    def get_usage(namespace, table_operations):
+        return {("submissions", "init_load"): {"PeakMemoryMB": 10000, "Runs": 5, "RunsStarted": 5}}
+
+    monkeypatch.setattr(sizing, "get_usage", get_usage)
+
+    sizes = sizing.get_task_sizes("canvas", {
+        "courses": sizing.get_operations(False),
+        "submissions": sizing.get_operations(True),
+    })
+
+    assert list(sizes["courses"]) == ["sync", "init"]
+    assert list(sizes["submissions"]) == ["sync", "init_prepare", "init_load", "init_commit"]
+    assert sizes["submissions"]["init_load"]["memory"] == 16384
+    assert sizes["courses"]["sync"] == {"cpu": sizing.TASK_CPU, "memory": sizing.TASK_MEMORY, "storage": sizing.TASK_STORAGE}
+    assert len(json.dumps(sizes["courses"])) < 200
@@ -0,0 +1,291 @@
+import json
+import types
+
+import pytest
+
+import app
+import worker
+from conftest import StubDatabase
+from table_common import sharded_init, table_init
+
+
+class StubStepFunctions:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def _record(self, name, **kwargs):
+        self.calls.append((name, kwargs))
+        if self.fail:
+            raise RuntimeError("TaskTimedOut")
+
+    def send_task_success(self, **kwargs):
+        self._record("success", **kwargs)
+
+    def send_task_failure(self, **kwargs):
+        self._record("failure", **kwargs)
+
+
+def sync_job(table_name="courses", token="token-1"):
+    return {"action": "sync", "task_token": token, "event": {"table_name": table_name, "namespace": "canvas"}}
+
+
+def init_job(table_name="courses", token="token-1", **kwargs):
+    return {"action": "init", "task_token": token, "event": {"table_name": table_name, "namespace": "canvas"}, **kwargs}
+
+
+@pytest.fixture(autouse=True)
+def task_setup(monkeypatch):
+    startup = types.SimpleNamespace(
+        credentials="credentials", db_user_secret={}, cloudwatch_log_url="https://log", summary={"seconds": 0.1}
+    )
+    monkeypatch.setattr(app, "bootstrap_task", lambda namespace: startup)
+    monkeypatch.setattr(app, "get_db_connection", lambda secret: (StubDatabase(), "cd2"))
+
+
+@pytest.fixture
+def synced(monkeypatch):
+    tables = []
+
+    def sync(event, credentials, db_connection, db_name, namespace, cloudwatch_log_url):
+        if event["table_name"] == "broken":
+            raise RuntimeError("sync blew up")
+        tables.append(event["table_name"])
+        return {**event, "state": app.STATE_COMPLETE}
+
+    monkeypatch.setattr(app, "sync", sync)
+    return tables
+
+
+@pytest.fixture
+def initialized(monkeypatch, tmp_path):
+    tables = []
+
+    async def init_table(credentials, api_base_url, db_connection, namespace, table_name):
+        if table_name == "broken":
+            raise RuntimeError("init blew up")
+        tables.append(table_name)
+
+    monkeypatch.setattr(table_init, "init_table", init_table)
+    monkeypatch.chdir(tmp_path)
+    return tables
+
+
+def run(job_queue, stepfunctions, on_receive=None):
+    w = worker.Worker(job_queue, stepfunctions)
+    # Stop once the queue is empty instead of polling forever
+    receive = job_queue.receive
+
+    def receive_or_drain(wait_seconds):
+        messages = receive(0)
+        if not messages:
+            w.drain()
+        if on_receive:
+            on_receive(w)
+        return messages
+
+    job_queue.receive = receive_or_drain
+    w.run()
+    return w
+
+
+def test_success_is_reported_and_message_deleted(synced):
+    job_queue = worker.LocalJobQueue([sync_job()])
+    stepfunctions = StubStepFunctions()
+
+    run(job_queue, stepfunctions)
+
+    assert synced == ["courses"]
+    [(name, kwargs)] = stepfunctions.calls
+    assert name == "success"
+    assert kwargs["taskToken"] == "token-1"
+    assert json.loads(kwargs["output"])["Payload"]["state"] == app.STATE_COMPLETE
+    assert job_queue.in_flight == {}
+
+
+def test_failure_is_reported_and_message_deleted(synced):
+    job_queue = worker.LocalJobQueue([sync_job("broken")])
+    stepfunctions = StubStepFunctions()
+
+    run(job_queue, stepfunctions)
+
+    [(name, kwargs)] = stepfunctions.calls
+    assert name == "failure"
+    assert kwargs["error"] == "sync blew up"
+    assert job_queue.in_flight == {}
+
+
+@pytest.mark.parametrize("table_name", ["courses", "broken"])
+def test_failed_callback_does_not_stop_the_worker(synced, table_name):
+    job_queue = worker.LocalJobQueue([sync_job(table_name), sync_job("users", "token-2")])
+    stepfunctions = StubStepFunctions(fail=True)
+
+    run(job_queue, stepfunctions)
+
+    # Each job reported once, not success followed by failure
+    assert [kwargs["taskToken"] for _, kwargs in stepfunctions.calls] == ["token-1", "token-2"]
+    assert "users" in synced
+    assert job_queue.in_flight == {}
+
+
+def test_job_of_killed_workers_is_failed_back(synced):
+    job_queue = worker.LocalJobQueue([sync_job()])
+    # Two workers took the job and died without deleting it
+    for _ in range(worker.WORKER_MAX_RECEIVE_COUNT):
+        [(handle, job, receive_count)] = job_queue.receive(0)
+        job_queue.release(handle)
+    stepfunctions = StubStepFunctions()
+
+    run(job_queue, stepfunctions)
+
+    assert synced == []
+    [(name, kwargs)] = stepfunctions.calls
+    assert name == "failure"
+    assert kwargs["taskToken"] == "token-1"
+    assert job_queue.in_flight == {}
+
+
+def test_init_runs_the_shared_init(initialized):
+    job_queue = worker.LocalJobQueue([init_job()])
+    stepfunctions = StubStepFunctions()
+
+    run(job_queue, stepfunctions)
+
+    assert initialized == ["courses"]
+    [(name, kwargs)] = stepfunctions.calls
+    assert name == "success"
+    payload = json.loads(kwargs["output"])["Payload"]
+    assert payload["state"] == "complete"
+    assert payload["startup"] == {"seconds": 0.1}
+    assert payload["resource_usage"]["operation"] == "init"
+
+
+def test_init_failure_is_returned_as_failed_state(initialized):
+    job_queue = worker.LocalJobQueue([init_job("broken")])
+    stepfunctions = StubStepFunctions()
+
+    run(job_queue, stepfunctions)
+
+    # Like init_table/app.py: a failed init is a result, not a task failure
+    [(name, kwargs)] = stepfunctions.calls
+    assert name == "success"
+    assert json.loads(kwargs["output"])["Payload"]["state"] == "failed"
+
+
+def test_init_job_can_run_a_sharded_phase(initialized, monkeypatch):
+    async def commit(credentials, api_base_url, db_connection, namespace, table_name, event, shard_results):
+        return sum(r["rows"] for r in shard_results)
+
+    monkeypatch.setattr(sharded_init, "commit", commit)
+    job = init_job(init_phase=sharded_init.PHASE_COMMIT, init_shard_results=[{"rows": 2}, {"rows": 3}])
+    stepfunctions = StubStepFunctions()
+
+    run(worker.LocalJobQueue([job]), stepfunctions)
+
+    payload = json.loads(stepfunctions.calls[0][1]["output"])["Payload"]
+    assert payload["init_rows"] == 5
+    assert payload["resource_usage"]["operation"] == "init_commit"
+
+
+def test_file_queue_runs_and_removes_jobs(synced, tmp_path):
+    job_queue = worker.FileJobQueue(str(tmp_path / "jobs"))
+    for i, table_name in enumerate(["courses", "users"]):
+        (tmp_path / "jobs" / f"{i}.json").write_text(json.dumps(sync_job(table_name, f"token-{i}")))
+    stepfunctions = StubStepFunctions()
+
+    run(job_queue, stepfunctions)
+
+    assert synced == ["courses", "users"]
+    assert [name for name, _ in stepfunctions.calls] == ["success", "success"]
+    assert list((tmp_path / "jobs").iterdir()) == []
+
+
+def test_draining_worker_finishes_current_job_and_leaves_the_rest(synced, monkeypatch):
+    job_queue = worker.LocalJobQueue([sync_job("courses"), sync_job("users", "token-2")])
+    stepfunctions = StubStepFunctions()
+    w = worker.Worker(job_queue, stepfunctions)
+    sync = app.sync
+
+    def sync_then_sigterm(*args):
+        w.drain()
+        return sync(*args)
+
+    monkeypatch.setattr(app, "sync", sync_then_sigterm)
+    w.run()
+
+    assert synced == ["courses"]
+    assert len(stepfunctions.calls) == 1
+    assert job_queue.receive(0)[0][1]["event"]["table_name"] == "users"
+
+
+def test_job_received_while_draining_is_released(synced, tmp_path):
+    job_queue = worker.FileJobQueue(str(tmp_path / "jobs"))
+    (tmp_path / "jobs" / "0.json").write_text(json.dumps(sync_job()))
+    stepfunctions = StubStepFunctions()
+
+    # SIGTERM arrives while the worker is waiting on the queue
+    run(job_queue, stepfunctions, on_receive=lambda w: w.drain())
+
+    assert synced == []
+    assert stepfunctions.calls == []
+    assert [p.name for p in (tmp_path / "jobs").iterdir()] == ["0.json"]
+
+
+def test_receive_errors_are_retried(synced, monkeypatch):
+    monkeypatch.setattr(worker, "WORKER_MIN_BACKOFF_SECONDS", 0.01)
+    job_queue = worker.LocalJobQueue([sync_job()])
+    receive = job_queue.receive
+    failures = [RuntimeError("ThrottlingException"), ConnectionError("connection reset")]
+
+    def flaky_receive(wait_seconds):
+        if failures:
+            raise failures.pop(0)
+        return receive(wait_seconds)
+
+    job_queue.receive = flaky_receive
+    stepfunctions = StubStepFunctions()
+
+    run(job_queue, stepfunctions)
+
+    assert synced == ["courses"]
+    assert [name for name, _ in stepfunctions.calls] == ["success"]
+
+
+class StubSQS:
+    def __init__(self, bodies):
+        self.messages = [
+            {"ReceiptHandle": f"handle-{i}", "Body": body, "Attributes": {"ApproximateReceiveCount": "1"}}
+            for i, body in enumerate(bodies)
+        ]
+        self.deleted = []
+
+    def receive_message(self, **kwargs):
+        return {"Messages": [self.messages.pop(0)]} if self.messages else {}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self.deleted.append(ReceiptHandle)
+
+    def change_message_visibility(self, **kwargs):
+        pass
+
+
+def test_undecodable_messages_are_deleted(synced):
+    sqs = StubSQS(["{not json", "[1, 2]", json.dumps(sync_job())])
+    stepfunctions = StubStepFunctions()
+
+    run(worker.SqsJobQueue("https://sqs.invalid/queue", sqs), stepfunctions)
+
+    assert sqs.deleted == ["handle-0", "handle-1", "handle-2"]
+    assert synced == ["courses"]
+    assert [name for name, _ in stepfunctions.calls] == ["success"]
+
+
+def test_undecodable_file_jobs_are_removed(synced, tmp_path):
+    job_queue = worker.FileJobQueue(str(tmp_path / "jobs"))
+    (tmp_path / "jobs" / "0.json").write_text("{not json")
+    stepfunctions = StubStepFunctions()
+
+    run(job_queue, stepfunctions)
+
+    assert stepfunctions.calls == []
+    assert list((tmp_path / "jobs").iterdir()) == []